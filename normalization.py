@@ -0,0 +1,60 @@
+# python3
+"""
+Utility function formulas, shared by the panettone normalization scripts and the pan_batido previews
+
+expression builds the numpy syntax formula evaluated block by block by gdal_calc.Calc (with NAMESPACE as its
+user_namespace), evaluate applies the same formula to an in-memory array.
+"""
+from numpy import asarray, clip, errstate, float32
+
+# methods whose formula depends on the raster minimum and maximum values
+MINMAX_METHODS = ["minmax", "maxmin", "bipiecewiselinear_percent", "stepup_percent", "stepdown_percent"]
+
+
+def clip01(data):
+    """Clamps the block to [0, 1] in place, no extra array is allocated"""
+    return clip(data, 0, 1, out=data)
+
+
+# functions available to the normalization expressions, passed as gdal_calc.Calc user_namespace
+NAMESPACE = {"clip01": clip01}
+
+
+def expression(method, params=(), minimum=None, maximum=None, alpha="A"):
+    """Single expression (numpy syntax) of the normalization method applied to the `alpha` input, same formulas as in
+    gdal_calc_norm main but with the bipiecewiselinear clamping done in the same pass.
+
+    Used for chaining several normalizations into one gdal_calc.Calc call (see gdal_calc_normsum), pass NAMESPACE as
+    the Calc user_namespace
+
+    :param method: one of the constants.METHODS names
+    :param params: list of floats according to the method, see gdal_calc_norm main
+    :param minimum: raster minimum, required by the MINMAX_METHODS
+    :param maximum: raster maximum, required by the MINMAX_METHODS
+    :param alpha: the letter representing the input raster in the expression
+    """
+    if method in MINMAX_METHODS and (minimum is None or maximum is None):
+        raise ValueError(f"Method {method} requires both minimum and maximum values")
+    A = alpha
+    r = (maximum - minimum) / 100 if method.endswith("_percent") else 1
+    if method == "minmax":
+        return f"({A}-{minimum})/({maximum} - {minimum})"
+    if method == "maxmin":
+        return f"({A}-{maximum})/({minimum} - {maximum})"
+    if method in ["stepup", "stepup_percent"]:
+        threshold = params[0] * r
+        return f"0*({A}<{threshold})+1*({A}>={threshold})"
+    if method in ["stepdown", "stepdown_percent"]:
+        threshold = params[0] * r
+        return f"1*({A}<{threshold})+0*({A}>={threshold})"
+    if method in ["bipiecewiselinear", "bipiecewiselinear_percent"]:
+        a, b = params[0] * r, params[1] * r
+        return f"clip01(({A}-{a})/({b}-{a}))"
+    raise ValueError(f"Unknown normalization method: {method}")
+
+
+def evaluate(data, method, params=(), minimum=None, maximum=None):
+    """Float32 data normalized by the expression of the method"""
+    with errstate(divide="ignore", invalid="ignore"):
+        result = eval(expression(method, params, minimum, maximum), {"__builtins__": {}, **NAMESPACE}, {"A": data})
+    return asarray(result, dtype=float32)
@@ -12,6 +12,7 @@ InteractiveShellEmbed()()
 # layer.dataProvider().bandStatistics(1).maximumValue,
 """
 import json
+from collections import deque
 from copy import deepcopy
 from dataclasses import dataclass, field
 from functools import partial
@@ -19,23 +20,34 @@ from pathlib import Path
 from re import sub
 from tempfile import NamedTemporaryFile
 
-from numpy import isnan
-from numpy import max as np_max
-from numpy import min as np_min
-from osgeo.gdal import GA_ReadOnly  # type: ignore
-from osgeo.gdal import ApplyGeoTransform, GA_Update, InvGeoTransform, Open
-from osgeo_utils.gdal_calc import Calc, GDALDataTypeNames
+from osgeo.gdal import GA_Update, Open  # type: ignore
+from osgeo_utils.gdal_calc import GDALDataTypeNames
 from PyQt5 import QtCore
 from PyQt5.QtCore import Qt, QTimer, QVariant
 from qgis.core import QgsMessageLog  # type: ignore
-from qgis.core import (Qgis, QgsApplication, QgsFeatureRequest, QgsProcessingAlgRunnerTask,
-                       QgsProcessingFeatureSourceDefinition, QgsProject, QgsRasterLayer, QgsRectangle, QgsTask,
-                       QgsVectorLayer)
+from qgis.core import (Qgis, QgsApplication, QgsCoordinateTransform, QgsGeometry, QgsProcessingAlgRunnerTask,
+                       QgsProject, QgsRasterLayer, QgsRectangle, QgsTask, QgsVectorLayer)
 
 from ..constants import TAG, UTILITY_FUNCTIONS
+from ..normalization import MINMAX_METHODS
+from ..stats_cache import compute_histogram, compute_windows_minmax, compute_zonal_minmax, get_raster_stats
+from . import norm_cache
+from .preview import compute_preview, utility_curve
 
 TITLE = "Pan-Europeo"
 DURATION = 3
+# concurrent get_file_info tasks when loading layers
+LAYER_INFO_TASKS = 4
+# threads reducing the rasters windows when the extent or the selection changes
+EXTENT_STATS_THREADS = 4
+# quiet time after the last extent or selection change before their min & max are calculated
+STATS_DEBOUNCE_MS = 300
+# min & max request kinds, each debounced on its own
+STATS_KINDS = ["extent", "selection"]
+# quiet time after the last edit or canvas change before the preview is recomputed
+PREVIEW_DEBOUNCE_MS = 200
+# (layer, extent) histograms kept, the cache is cleared when full
+HISTOGRAM_CACHE_SIZE = 256
 
 
 def breakit():
@@ -87,19 +99,54 @@ class Model(QtCore.QAbstractItemModel):
         self.iface = iface
         self.context = context
         self.layers = []
+        self.tasks = {}  # : QgsProcessingAlgRunnerTask
+        self.pending_info = deque()  # layers waiting for a get_file_info task
+        self.running_info = 0
+        # extent & selection min/max requests, see request_stats
+        self.stats_timers = {}
+        for kind in STATS_KINDS:
+            self.stats_timers[kind] = QTimer()
+            self.stats_timers[kind].setSingleShot(True)
+            self.stats_timers[kind].timeout.connect(partial(self.run_stats_request, kind))
+        self.stats_requests = dict.fromkeys(STATS_KINDS)  # kind: latest (function, args, kwargs) waiting for its timer
+        self.stats_generations = dict.fromkeys(STATS_KINDS, 0)  # results of older requests are discarded
+        self.stats_tasks = {}  # task: (kind, generation, ids of its rasters)
+        self.stats_counters = dict.fromkeys(["requested", "dropped", "executed", "cancelled", "discarded"], 0)
+        self.last_sum = None  # {"file", "keys", "weights"} of the last weighted sum, see partial_sum
+        # canvas resolution weighted sum, see run_preview
+        self.preview_enabled = False
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.timeout.connect(self.run_preview)
+        self.preview_generation = 0  # results of older previews are discarded
+        self.preview_task = None
+        self.preview_layer_id = None
+        # per row utility function preview, see utility_preview
+        self.histograms = {}  # (filepath, bbox): compute_histogram result
+        self.pending_histograms = {}  # (filepath, bbox): task
+        self.histogram_extent = None
         self.load_layers()
         QgsProject.instance().layersRemoved.connect(self.on_layers_removed)
         QgsProject.instance().layersAdded.connect(self.on_layers_added)
         self.visibilityChanged.connect(self.update_layer_visibility)
-        self.iface.mapCanvas().selectionChanged.connect(self.on_iface_selection_changed)
-        self.tasks = {}  # : QgsProcessingAlgRunnerTask
+        self.iface.mapCanvas().selectionChanged.connect(self.request_selection_minmax)
+        self.iface.mapCanvas().extentsChanged.connect(self.request_preview)
 
     def reset(self):
         self.cancel_tasks()
+        self.stats_tasks.clear()
+        self.pending_info.clear()
+        self.last_sum = None
+        self.histograms.clear()
+        self.pending_histograms.clear()
         self.layers = []
         self.load_layers()
 
     def cancel_tasks(self):
+        for timer in self.stats_timers.values():
+            timer.stop()
+        self.preview_timer.stop()
+        self.stats_requests = dict.fromkeys(STATS_KINDS)
         # list copies preventing RuntimeError "dictionary changed size during iteration"
         for task in list(self.tasks.keys()):
             try:
@@ -130,7 +177,7 @@ class Model(QtCore.QAbstractItemModel):
         return 0
 
     def columnCount(self, parent=QtCore.QModelIndex()):
-        return 5
+        return 6
 
     def data(self, index, role):
         if not index.isValid():
@@ -158,6 +205,8 @@ class Model(QtCore.QAbstractItemModel):
             ]
             # print(f"Model:data: ({row}, {column}), {sliders=}")
             return sliders
+        if role == Qt.EditRole and column == 5:
+            return self.utility_preview(layer)
 
         return QVariant()
 
@@ -170,19 +219,23 @@ class Model(QtCore.QAbstractItemModel):
                 self.dataChanged.emit(index, index)
                 # self.save()
                 self.visibilityChanged.emit(lid, value == Qt.Checked)
+                self.request_preview()
                 return True
         if role == Qt.EditRole and column == 2:
             self.layers[index.row()].weight = value
             self.dataChanged.emit(index, index)
             # self.save()
+            self.request_preview()
             return True
         if role == Qt.EditRole and column == 3:
             # print(f"Model:setData: ({row}, {column}), {value=}, {role=}")
             layer = self.layers[row]
             layer.util_funcs = value["cb"]
             layer.uf_idx = value["idx"]
-            self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole])
+            # the params & preview columns follow the utility function
+            self.dataChanged.emit(index, self.index(row, 5), [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole])
             # self.save()
+            self.request_preview()
             return True
         if role == Qt.EditRole and column == 4:
             # print(f"Model:setData: ({row}, {column}), {value=}, {role=}")
@@ -191,8 +244,9 @@ class Model(QtCore.QAbstractItemModel):
             for slider in value:
                 param_name, _, val, _ = slider
                 layer.util_funcs[layer.uf_idx]["params"][param_name]["value"] = val
-            self.dataChanged.emit(index, index)
+            self.dataChanged.emit(index, self.index(row, 5))
             # self.save()
+            self.request_preview()
             return True
         return False
 
@@ -217,6 +271,8 @@ class Model(QtCore.QAbstractItemModel):
                 return "Utility function"
             if section == 4:
                 return "Params"
+            if section == 5:
+                return "Preview"
 
     def load(self):
         try:
@@ -236,9 +292,11 @@ class Model(QtCore.QAbstractItemModel):
             #     pprint(uf)
 
     def load_layers(self):
+        """Rows are inserted right away, min, max & extent are filled in by background tasks (see request_layer_info)"""
         for lid, layer in QgsProject.instance().mapLayers().items():
+            if lid == self.preview_layer_id:
+                continue
             if isinstance(layer, QgsRasterLayer) and Path(layer.publicSource()).is_file():
-                min_, max_, extent = get_file_info(layer.publicSource())
                 layer_tree_layer = QgsProject.instance().layerTreeRoot().findLayer(lid)
                 layer_tree_layer.visibilityChanged.connect(self.on_layer_visibility_changed)
                 self.layers += [
@@ -247,15 +305,50 @@ class Model(QtCore.QAbstractItemModel):
                         visibility=layer_tree_layer.isVisible(),
                         name=layer.name(),
                         filepath=layer.publicSource(),
-                        min=min_,
-                        max=max_,
-                        extent=extent,
                     )
                 ]
+                self.request_layer_info(self.layers[-1])
         self.dataChanged.emit(
             self.index(0, self.columnCount() - 1), self.index(len(self.layers) - 1, self.columnCount() - 1)
         )
 
+    def request_layer_info(self, layer):
+        self.pending_info.append(layer)
+        self.start_layer_info_tasks()
+
+    def start_layer_info_tasks(self):
+        """Runs get_file_info in at most LAYER_INFO_TASKS background tasks"""
+        while self.pending_info and self.running_info < LAYER_INFO_TASKS:
+            layer = self.pending_info.popleft()
+            task = QgsTask.fromFunction(
+                "Get min, max & extent of raster " + layer.name,
+                get_file_info_task,
+                filename=layer.filepath,
+                on_finished=partial(self.set_layer_info_on_fin, layer),
+            )
+            self.running_info += 1
+            self.tasks[task] = task.status()
+            QgsApplication.taskManager().addTask(task)
+
+    def set_layer_info_on_fin(self, layer, exception, result=None):
+        """QgsTask.fromFunction on_finished, result is the get_file_info_task (min, max, extent) tuple"""
+        self.running_info -= 1
+        self.start_layer_info_tasks()
+        # the layer may have been removed or the model reset meanwhile
+        row = next((i for i, lyr in enumerate(self.layers) if lyr is layer), None)
+        if row is None:
+            return
+        if exception:
+            QgsMessageLog.logMessage(f"Reading {layer.name} info failed: {exception}", tag=TAG, level=Qgis.Warning)
+            return
+        if result is None:
+            # canceled
+            return
+        layer.min, layer.max, layer.extent = result
+        # the dialog restored the rows loaded so far, this one's sliders range over its min & max now
+        self.restore_layer_minmax(layer)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
     def on_layer_visibility_changed(self, node):
         layer_id = node.layerId()
         for i, layer in enumerate(self.layers):
@@ -272,18 +365,18 @@ class Model(QtCore.QAbstractItemModel):
 
     def on_layers_added(self, add_layers):
         for layer in add_layers:
+            if layer.id() == self.preview_layer_id:
+                continue
             if isinstance(layer, QgsRasterLayer) and Path(layer.publicSource()).is_file():
-                min_, max_, extent = get_file_info(layer.publicSource())
                 self.layers += [
                     Layer(
                         id=layer.id(),
                         visibility=True,
                         name=layer.name(),
-                        min=min_,
-                        max=max_,
-                        extent=extent,
+                        filepath=layer.publicSource(),
                     )
                 ]
+                self.request_layer_info(self.layers[-1])
                 QTimer.singleShot(0, lambda lid=layer.id(): self.connect_layer_visibility_signal(lid))
         self.layoutChanged.emit()
         # self.save()
@@ -298,6 +391,65 @@ class Model(QtCore.QAbstractItemModel):
         if layer_tree_layer:
             layer_tree_layer.setItemVisibilityChecked(visibility)
 
+    def request_stats(self, kind, function, *args, **kwargs):
+        """Debounces & coalesces the extent and selection min/max calculations: function(*args, **kwargs) runs
+        STATS_DEBOUNCE_MS after the last request of its kind, the previous ones of the same kind waiting are dropped"""
+        self.stats_counters["requested"] += 1
+        if self.stats_requests[kind] is not None:
+            self.stats_counters["dropped"] += 1
+        self.stats_requests[kind] = function, args, kwargs
+        self.stats_timers[kind].start(STATS_DEBOUNCE_MS)
+
+    def request_extent_minmax(self, extent, **kwargs):
+        self.request_stats("extent", self.calc_extent_minmax, extent, **kwargs)
+
+    def request_selection_minmax(self, layer):
+        self.request_stats("selection", self.on_iface_selection_changed, layer)
+
+    def run_stats_request(self, kind):
+        if self.stats_requests[kind] is None:
+            return
+        function, args, kwargs = self.stats_requests[kind]
+        self.stats_requests[kind] = None
+        self.stats_generations[kind] += 1
+        self.stats_counters["executed"] += 1
+        try:
+            function(*args, **kwargs)
+        except RuntimeError as e:
+            # the selection layer was deleted meanwhile
+            QgsMessageLog.logMessage(f"Min & max request failed: {e}", tag=TAG, level=Qgis.Warning)
+        QgsMessageLog.logMessage(f"Min & max requests {self.stats_counters}", tag=TAG, level=Qgis.Info)
+
+    def add_stats_task(self, task, kind, rasters):
+        """Cancels the running stats tasks of older requests of the same kind on any of the rasters, then starts the
+        task"""
+        ids = {id(raster) for raster in rasters}
+        for other, (other_kind, generation, other_ids) in list(self.stats_tasks.items()):
+            if other_kind != kind or generation == self.stats_generations[kind]:
+                continue
+            if ids & other_ids:
+                self.cancel_stats_task(other)
+        self.stats_tasks[task] = (kind, self.stats_generations[kind], ids)
+        self.tasks[task] = task.status()
+        QgsApplication.taskManager().addTask(task)
+
+    def cancel_stats_task(self, task):
+        try:
+            if task.isActive():
+                task.cancel()
+                self.stats_counters["cancelled"] += 1
+        except RuntimeError:
+            # already finished & deleted
+            pass
+        self.stats_tasks.pop(task, None)
+
+    def is_stale(self, kind, generation):
+        """Results of a superseded request of its kind, counted as discarded"""
+        if generation != self.stats_generations[kind]:
+            self.stats_counters["discarded"] += 1
+            return True
+        return False
+
     def on_iface_selection_changed(self, layer):
         """Handle the selectionChanged signal from the map canvas."""
         # print(f"iface.selectionChanged: {layer=}")
@@ -308,123 +460,84 @@ class Model(QtCore.QAbstractItemModel):
             QgsMessageLog.logMessage("No features selected", tag=TAG, level=Qgis.Warning)
             return
 
+        rasters = [raster for raster in self.layers if raster.filepath]
+        if not rasters:
+            return
+        # rasters share the project crs (see README), the selection is sent in the first one's crs
+        raster_layer = QgsProject.instance().mapLayer(rasters[0].id)
+        crs = raster_layer.crs() if raster_layer else QgsProject.instance().crs()
+        transform = QgsCoordinateTransform(layer.crs(), crs, QgsProject.instance())
+        geometries = []
+        for feature in layer.selectedFeatures():
+            geometry = QgsGeometry(feature.geometry())
+            if geometry.isEmpty():
+                continue
+            geometry.transform(transform)
+            geometries += [bytes(geometry.asWkb())]
+
         text = f"Calculating min/max for {layer.selectedFeatureCount()} selected features of {layer.name()}"
         level = Qgis.Info
         self.iface.messageBar().pushMessage(TITLE, text, level, DURATION)
         # self.view.message_bar.pushMessage(TITLE, text, level, DURATION)
-        for raster in self.layers:
-            # print(f"{raster.name=}, {raster.filepath=}")
-            task = QgsProcessingAlgRunnerTask(
-                algorithm=QgsApplication.processingRegistry().algorithmById("native:zonalstatisticsfb"),
-                parameters={
-                    "COLUMN_PREFIX": "_",
-                    "INPUT": QgsProcessingFeatureSourceDefinition(
-                        layer.publicSource(),
-                        selectedFeaturesOnly=True,
-                        featureLimit=-1,
-                        geometryCheck=QgsFeatureRequest.GeometryAbortOnInvalid,
-                    ),
-                    "INPUT_RASTER": raster.filepath,
-                    "OUTPUT": "TEMPORARY_OUTPUT",
-                    "RASTER_BAND": 1,
-                    "STATISTICS": [5, 6],
-                },
-                context=self.context,
-            )
-            # description = f"Min&Max Zonal Statistics for {raster.name}, on {layer.selectedFeatureCount()} selected  features of {layer.name()}"
-            raster_short_name = raster.name[:6] + "..." if len(raster.name) > 6 else raster.name
-            layer_short_name = layer.name()[:6] + "..." if len(layer.name()) > 6 else layer.name
-            description = f"Min&Max Zonal Statistics for {raster_short_name}, on {layer_short_name} x{layer.selectedFeatureCount()}"
-            task.setDescription(description)
-            task.executed.connect(
-                partial(
-                    self.on_iface_selection_changed_task_finished,
-                    context=self.context,
-                    description=description,
-                    raster=raster,
-                )
-            )
-            self.tasks[task] = task.status()
-            QgsApplication.taskManager().addTask(task)
-        # print(f"iface.selectionChanged_end: {self.tasks=}")
+        layer_short_name = layer.name()[:6] + "..." if len(layer.name()) > 6 else layer.name()
+        description = f"Min&Max Zonal Statistics for {len(rasters)} rasters, on {layer_short_name} x{len(geometries)}"
+        task = QgsTask.fromFunction(
+            description,
+            get_zonal_minmax_task,
+            filepaths=[raster.filepath for raster in rasters],
+            geometries=geometries,
+            on_finished=partial(
+                self.on_iface_selection_changed_task_finished,
+                self.stats_generations["selection"],
+                rasters,
+                description,
+            ),
+        )
+        self.add_stats_task(task, "selection", rasters)
 
-    def on_iface_selection_changed_task_finished(self, successful, results, context=None, description="", raster=None):
-        # print(f"iface.selectionChanged_task_finished: {successful=} {results=}")
+    def on_iface_selection_changed_task_finished(self, generation, rasters, description, exception, results=None):
         pre_msg = f'Task "{description}"'
-        if not successful:
-            QgsMessageLog.logMessage(f"{pre_msg} finished unsuccessfully", tag=TAG, level=Qgis.Warning)
-            QgsMessageLog.logMessage(f"{pre_msg} {results=}", tag=TAG, level=Qgis.Critical)
-            return
-        output_layer = context.getMapLayer(results["OUTPUT"])
-        # print(output_layer.fields().names())
-        if not output_layer:
-            QgsMessageLog.logMessage(f"{pre_msg} No output layer", tag=TAG, level=Qgis.Warning)
+        if self.is_stale("selection", generation):
             return
-        if not output_layer.isValid():
-            QgsMessageLog.logMessage(f"{pre_msg} Output layer is not valid", tag=TAG, level=Qgis.Warning)
+        if exception:
+            QgsMessageLog.logMessage(f"{pre_msg} finished unsuccessfully: {exception}", tag=TAG, level=Qgis.Warning)
             return
-        # QgsProject.instance().addMapLayer(context.takeResultLayer(output_layer.id()))
-        if output_layer.featureCount() == 0:
-            QgsMessageLog.logMessage(f"{pre_msg} Output layer has no features", tag=TAG, level=Qgis.Warning)
+        if results is None:
+            # canceled
             return
-
-        # get min and max values from the output layer
-        min_, max_ = float("inf"), float("-inf")
-        for feat in output_layer.getFeatures():
-            # print(f"{feat['_min']=}, {feat['_max']=}")
-            if feat["_min"] < min_:
-                min_ = feat["_min"]
-            if feat["_max"] > max_:
-                max_ = feat["_max"]
-
-        # set the min and max values to the model layers
-        # print(f"View:on_iface_selection_changed_task_finished:321 {pre_msg=}")
-        # breakit()()
-        any_change = False
-        for util_func in raster.util_funcs:
-            if "percent" in util_func["name"]:
+        for raster, result in zip(rasters, results):
+            # the layer may have been removed or the model reset meanwhile
+            if not any(layer is raster for layer in self.layers):
                 continue
-            for name, params in util_func["params"].items():
-                if "min" in params:
-                    # params["min"] = min_
-                    uf_id = raster.util_funcs.index(util_func)
-                    raster.util_funcs[uf_id]["params"][name]["min"] = min_
-                    any_change = True
-                if "max" in params:
-                    # params["max"] = max_
-                    uf_id = raster.util_funcs.index(util_func)
-                    raster.util_funcs[uf_id]["params"][name]["max"] = max_
-                    any_change = True
-        if any_change:
-            # create a QModelIndex for the layer
-            # TODO use self.index instead ?
-            # print(f"View:on_iface_selection_changed_task_finished:342 {pre_msg=}")
-            # breakit()()
-            index = self.index(self.layers.index(raster), 4)
-            self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
-            # top_left_index = self.index(self.layers.index(raster), 3)
-            # bottom_right_index = self.index(self.layers.index(raster), 4)
-            # self.dataChanged.emit(top_left_index, bottom_right_index, [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole])
-            self.layoutChanged.emit()
-            # self.save()
+            if result is None or result["count"] == 0:
+                QgsMessageLog.logMessage(f"{pre_msg} {raster.name} has no data inside", tag=TAG, level=Qgis.Warning)
+                continue
+            min_, max_ = result["min"], result["max"]
 
-            # for lyrs in self.layers:
-            #     if lyrs.name == raster.name:
-            #        print("heyy0")
-            #        for util_func in lyrs.util_funcs:
-            #            print(f"\t{util_func['name']}")
-            #            for name, params in util_func["params"].items():
-            #                print(f"\t\t{name}, {params}")
-            #        for util_func in raster.util_funcs:
-            #            print(f"\t{util_func['name']}")
-            #            for name, params in util_func["params"].items():
-            #                print(f"\t\t{name}, {params}")
-            #        assert lyrs.util_funcs == raster.util_funcs
-            #        print("heyy1")
-
-        QgsMessageLog.logMessage(
-            f"{pre_msg} finished successfully, new {min_=}, {max_=}, {any_change=}", tag=TAG, level=Qgis.Info
-        )
+            # set the min and max values to the model layers
+            any_change = False
+            for util_func in raster.util_funcs:
+                if "percent" in util_func["name"]:
+                    continue
+                for name, params in util_func["params"].items():
+                    if "min" in params:
+                        uf_id = raster.util_funcs.index(util_func)
+                        raster.util_funcs[uf_id]["params"][name]["min"] = min_
+                        any_change = True
+                    if "max" in params:
+                        uf_id = raster.util_funcs.index(util_func)
+                        raster.util_funcs[uf_id]["params"][name]["max"] = max_
+                        any_change = True
+            if any_change:
+                index = self.index(self.layers.index(raster), 4)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+                self.layoutChanged.emit()
+
+            QgsMessageLog.logMessage(
+                f"{pre_msg} {raster.name} finished successfully, new {min_=}, {max_=}, {any_change=}",
+                tag=TAG,
+                level=Qgis.Info,
+            )
 
     def balance_weights(self):
         total = sum(layer.weight for layer in self.layers if layer.visibility) / 100
@@ -443,43 +556,70 @@ class Model(QtCore.QAbstractItemModel):
         projwin=None,
         outfile="",
         skip_normalization=False,
+        fused=False,
+        memory_budget=None,
     ):
         """
         from osgeo_utils.gdal_calc import GDALDataTypeNames
         rtype 7: Float32 : GDALDataTypeNames[7]
+
+        fused: single task normalizing and summing in one pass (see doit_fused), no intermediate rasters are written
+        memory_budget: such as "512MB", sizes the gdal_calc blocks (None for the default). The normalizator tasks running
+        at once split it, the summator or single pass task runs alone with all of it
+
+        Normalized rasters are kept in norm_cache, the unchanged layers aren't normalized again. When only one layer
+        changed since the last weighted sum, that sum is updated instead of summing every layer (see partial_sum)
         """
-        print(f"Model.doit: {load_normalized=}, {no_data=}, {rtype=}")
+        print(f"Model.doit: {load_normalized=}, {no_data=}, {rtype=}, {fused=}")
         self.save()
+        last_sum, self.last_sum = self.last_sum, None
+        if fused and not skip_normalization:
+            self.doit_fused(no_data=no_data, rtype=rtype, projwin=projwin, outfile=outfile, memory_budget=memory_budget)
+            return
         norm_tasks = {}
+        norm_budget = memory_budget
+        if memory_budget and not skip_normalization:
+            from gdal_calc import parse_memory
+
+            running = min(
+                sum(raster.visibility for raster in self.layers), QgsApplication.taskManager().maxActiveThreadCount()
+            )
+            try:
+                norm_budget = str(parse_memory(memory_budget) // max(1, running))
+            except ValueError:
+                # reported by the algorithms
+                pass
         norm_files = [raster.filepath for raster in self.layers if raster.visibility]
         norm_names = [clean_str(raster.name) for raster in self.layers if raster.visibility]
         if not skip_normalization:
             norm_files = []
+            norm_keys = []
             for raster in self.layers:
                 if not raster.visibility:
                     continue
                 print(f"{raster.name=}, {raster.filepath=}")
-                util_func = raster.util_funcs[raster.uf_idx]
-                # normalization method
-                method = util_func["name"]
-                print(f"{method=}")
-                # don't need minmax
-                if method in ["minmax", "maxmin", "bipiecewiselinear_percent", "stepup_percent", "stepdown_percent"]:
-                    minimum, maximum = None, None
-                else:
-                    params = util_func["params"]
-                    if len(params) > 0:
-                        first = list(params.values())[0]
-                        minimum, maximum = first["min"], first["max"]
-                    else:
-                        # print("no params!?")
-                        minimum, maximum = None, None
-                # params
-                func_params = util_func["params"]
-                func_values_str = " ".join([str(param["value"]) for param in func_params.values()])
-                print(f"{func_values_str=}")
+                method, minimum, maximum, func_values = get_normalization_args(raster)
+                func_values_str = " ".join(map(str, func_values))
+                print(f"{method=}, {func_values_str=}")
+                key = norm_cache.norm_key(
+                    raster.filepath, method, func_values, minimum, maximum, projwin, rtype, no_data
+                )
+                norm_keys += [key]
+                if cached := norm_cache.lookup(key):
+                    norm_files += [cached]
+                    QgsMessageLog.logMessage(
+                        f"Reusing {raster.name} {method} {func_values_str} normalized raster {cached}",
+                        tag=TAG,
+                        level=Qgis.Info,
+                    )
+                    if load_normalized:
+                        QgsProject.instance().addMapLayer(QgsRasterLayer(cached, "norm_" + raster.name))
+                    continue
                 # output file
-                norm_file = NamedTemporaryFile(suffix=".tif", delete=False).name
+                if key:
+                    norm_file = norm_cache.output_file(key)
+                else:
+                    norm_file = NamedTemporaryFile(suffix=".tif", delete=False).name
                 norm_files += [norm_file]
 
                 task = QgsProcessingAlgRunnerTask(
@@ -495,6 +635,7 @@ class Model(QtCore.QAbstractItemModel):
                         "PARAMS": func_values_str,
                         "PROJWIN": projwin,
                         "RTYPE": rtype,
+                        "MEMORY_BUDGET": norm_budget,
                     },
                     context=self.context,
                 )
@@ -514,6 +655,7 @@ class Model(QtCore.QAbstractItemModel):
                         add2map=load_normalized,
                         description=description,
                         metadata=metadata,
+                        cache_key=key,
                     )
                 )
                 norm_tasks[task] = task.status()
@@ -522,23 +664,44 @@ class Model(QtCore.QAbstractItemModel):
                     f'Adding task "{description}". Weight:{raster.weight}%', tag=TAG, level=Qgis.Info
                 )
 
+            deleted = norm_cache.evict(keep=norm_keys + (last_sum["keys"] if last_sum else []))
+            if deleted:
+                QgsMessageLog.logMessage(
+                    f"Evicted {deleted} normalized rasters from the cache", tag=TAG, level=Qgis.Info
+                )
+
         weights = [r.weight / 100 for r in self.layers if r.visibility]
-        weights_str = " ".join(map(str, weights))
         dot_prod_str = " + ".join([f"{w:0.5f} x {n}" for w, n in zip(weights, norm_names)])
+        sum_files, sum_weights = norm_files, weights
+        description = f"Weighted Sum of {len(norm_files)} normalized rasters"
+        sum_state = None
+        if not skip_normalization:
+            sum_state = {"keys": norm_keys, "weights": weights}
+            if update := self.partial_sum(last_sum, norm_keys, weights, rtype, outfile):
+                k, previous_file, previous_norm = update
+                # result_new = result_old - w_k * old_norm_k + w_k * new_norm_k
+                sum_files = [previous_file, previous_norm, norm_files[k]]
+                sum_weights = [1, -weights[k], weights[k]]
+                description = f"Weighted Sum update of {norm_names[k]}"
+                QgsMessageLog.logMessage(
+                    f"Only {norm_names[k]} changed, updating the previous weighted sum {previous_file}",
+                    tag=TAG,
+                    level=Qgis.Info,
+                )
         final_task = QgsProcessingAlgRunnerTask(
             algorithm=QgsApplication.processingRegistry().algorithmById("paneuropeo:weightedsummator"),
             parameters={
                 "EXTENT_OPT": 0,
-                "INPUT": norm_files,
+                "INPUT": sum_files,
                 "OUTPUT": "TEMPORARY_OUTPUT" if outfile == "" else outfile,
                 "PROJWIN": projwin if skip_normalization else None,
                 "RTYPE": rtype,
-                "WEIGHTS": weights_str,
+                "MEMORY_BUDGET": memory_budget,
+                "WEIGHTS": " ".join(map(str, sum_weights)),
                 "HIDE_NO_DATA": True,
             },
             context=self.context,
         )
-        description = f"Weighted Sum of {len(norm_files)} normalized rasters"
         final_task.executed.connect(
             partial(
                 self.on_doit_task_finished,
@@ -546,6 +709,7 @@ class Model(QtCore.QAbstractItemModel):
                 add2map=True,
                 description=description,
                 metadata={"DESCRIPTION": f"Summary: {dot_prod_str}", "AUTHOR": "PanEuropeo"},
+                sum_state=sum_state,
             )
         )
         for task in norm_tasks:
@@ -558,8 +722,92 @@ class Model(QtCore.QAbstractItemModel):
         QgsMessageLog.logMessage(f'Starting parent Task "{description}"', tag=TAG, level=Qgis.Info)
         # print(f"Model.doit: {self.tasks=}")
 
+    @staticmethod
+    def partial_sum(last_sum, norm_keys, weights, rtype, outfile):
+        """(k, previous sum file, previous normalized file of layer k) when layer k is the only normalized raster that
+        changed since last_sum, with the same weights; else None for a full weighted sum.
+
+        Keys change with the projwin, output type & nodata, so a different grid or nodata policy always changes every
+        key. The summator uses the nodata values as-is (HIDE_NO_DATA) so the update is pixel exact up to rounding,
+        integer outputs are always fully summed instead of accumulating their truncation. A None rtype is the
+        algorithms Float32 default"""
+        if not last_sum or (rtype is not None and GDALDataTypeNames[rtype] not in ["Float32", "Float64"]):
+            return None
+        if len(last_sum["keys"]) != len(norm_keys) or last_sum["weights"] != weights or None in norm_keys:
+            return None
+        changed = [k for k, (old, new) in enumerate(zip(last_sum["keys"], norm_keys)) if old != new]
+        if len(changed) != 1:
+            return None
+        k = changed[0]
+        previous_file = last_sum["file"]
+        # outfile would be overwritten while being read
+        if not Path(previous_file).is_file() or (outfile and Path(outfile).resolve() == Path(previous_file).resolve()):
+            return None
+        if previous_norm := norm_cache.lookup(last_sum["keys"][k]):
+            return k, previous_file, previous_norm
+        return None
+
+    def doit_fused(
+        self, no_data=None, rtype=GDALDataTypeNames.index("Float32"), projwin=None, outfile="", memory_budget=None
+    ):
+        """Single "paneuropeo:normsummator" task instead of one normalizator task per raster plus the summator:
+        each input block is read once, normalized, pondered and summed in memory, writing only the final raster
+        """
+        rasters = [raster for raster in self.layers if raster.visibility]
+        methods, params, minimums, maximums = [], [], [], []
+        for raster in rasters:
+            method, minimum, maximum, func_values = get_normalization_args(raster)
+            methods += [method]
+            params += [",".join(map(str, func_values)) if func_values else "none"]
+            minimums += ["none" if minimum is None else str(minimum)]
+            maximums += ["none" if maximum is None else str(maximum)]
+        weights = [r.weight / 100 for r in rasters]
+        dot_prod_str = " + ".join(
+            [f"{w:0.5f} x {clean_str(m)}({clean_str(r.name)})" for w, m, r in zip(weights, methods, rasters)]
+        )
+        task = QgsProcessingAlgRunnerTask(
+            algorithm=QgsApplication.processingRegistry().algorithmById("paneuropeo:normsummator"),
+            parameters={
+                "EXTENT_OPT": 0,
+                "INPUT": [raster.filepath for raster in rasters],
+                "METHODS": " ".join(methods),
+                "PARAMS": " ".join(params),
+                "MINIMUMS": " ".join(minimums),
+                "MAXIMUMS": " ".join(maximums),
+                "NO_DATA": no_data,
+                "OUTPUT": "TEMPORARY_OUTPUT" if outfile == "" else outfile,
+                "PROJWIN": projwin,
+                "RTYPE": rtype,
+                "MEMORY_BUDGET": memory_budget,
+                "WEIGHTS": " ".join(map(str, weights)),
+            },
+            context=self.context,
+        )
+        description = f"Normalize & Weighted Sum of {len(rasters)} rasters"
+        task.setDescription(description)
+        task.executed.connect(
+            partial(
+                self.on_doit_task_finished,
+                force_name="WEIGHTED_SUM" if outfile == "" else Path(outfile).stem,
+                add2map=True,
+                description=description,
+                metadata={"DESCRIPTION": f"Summary: {dot_prod_str}", "AUTHOR": "PanEuropeo"},
+            )
+        )
+        self.tasks[task] = task.status()
+        QgsApplication.taskManager().addTask(task)
+        QgsMessageLog.logMessage(f'Starting Task "{description}"', tag=TAG, level=Qgis.Info)
+
     def on_doit_task_finished(
-        self, successful, results, force_name="Result", add2map=lambda: True, description="", metadata={}
+        self,
+        successful,
+        results,
+        force_name="Result",
+        add2map=lambda: True,
+        description="",
+        metadata={},
+        cache_key=None,
+        sum_state=None,
     ):
         pre_msg = f'Task "{description}"'
         if not successful:
@@ -568,6 +816,12 @@ class Model(QtCore.QAbstractItemModel):
                 f"{pre_msg} {results=}, check the Processing tab logs for more info!", tag=TAG, level=Qgis.Critical
             )
             return
+        if cache_key:
+            # the normalized raster can be reused
+            norm_cache.commit(cache_key, description)
+        if sum_state:
+            # the next run can update this sum
+            self.last_sum = {**sum_state, "file": results["OUTPUT"]}
         output_layer = self.context.getMapLayer(results["OUTPUT"])
         # QgsMessageLog.logMessage(f"Task finished successfully {results}", tag=TAG, level=Qgis.Info)
         if add2map:
@@ -588,10 +842,172 @@ class Model(QtCore.QAbstractItemModel):
                 QgsMessageLog.logMessage(f"{pre_msg} added raster from file.", tag=TAG, level=Qgis.Success)
                 # print("from file")
 
-    def calc_extent_minmax(self, extent):
-        # QgsMessageLog.logMessage("Model.calc_extent_minmax 0", TAG, Qgis.Info)
-        # print("Model.calc_extent_minmax 0")
+    def set_preview(self, enabled):
+        """Live preview on/off, off removes the preview layer"""
+        self.preview_enabled = enabled
+        if enabled:
+            self.request_preview()
+            return
+        self.preview_timer.stop()
+        self.preview_generation += 1
+        self.remove_preview_layer()
+
+    def request_preview(self, *args):
+        """Debounces the preview: it runs PREVIEW_DEBOUNCE_MS after the last edit or canvas change"""
+        if self.preview_enabled:
+            self.preview_timer.start(PREVIEW_DEBOUNCE_MS)
+
+    def run_preview(self):
+        """Weighted sum of the visible rasters normalized with the current utility functions, over the canvas extent at
+        the canvas resolution (see preview.compute_preview), shown as a temporary layer"""
+        rasters = [raster for raster in self.layers if raster.visibility]
+        if not rasters:
+            self.remove_preview_layer()
+            return
+        crs_layer = QgsProject.instance().mapLayer(rasters[0].id)
+        if crs_layer is None:
+            return
+        canvas = self.iface.mapCanvas()
+        transform = QgsCoordinateTransform(
+            canvas.mapSettings().destinationCrs(), crs_layer.crs(), QgsProject.instance()
+        )
+        extent = transform.transformBoundingBox(canvas.extent())
+        size = canvas.mapSettings().outputSize()
+        if extent.isEmpty() or size.width() <= 0 or size.height() <= 0:
+            return
+        args = []
+        for raster in rasters:
+            method, minimum, maximum, func_values = get_normalization_args(raster)
+            args += [(raster.filepath, method, func_values, minimum, maximum, raster.weight / 100)]
+        self.preview_generation += 1
+        # only the latest preview matters
+        try:
+            if self.preview_task is not None and self.preview_task.isActive():
+                self.preview_task.cancel()
+        except RuntimeError:
+            # already deleted
+            pass
+        task = QgsTask.fromFunction(
+            "Preview weighted sum",
+            get_preview_task,
+            rasters=args,
+            bbox=[extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+            width=size.width(),
+            height=size.height(),
+            on_finished=partial(self.on_preview_finished, self.preview_generation),
+        )
+        self.preview_task = task
+        self.tasks[task] = task.status()
+        QgsApplication.taskManager().addTask(task)
+
+    def on_preview_finished(self, generation, exception, result=None):
+        if exception:
+            QgsMessageLog.logMessage(f"Preview failed: {exception}", tag=TAG, level=Qgis.Warning)
+            return
+        if result is None:
+            # canceled
+            return
+        if generation != self.preview_generation or not self.preview_enabled:
+            Path(result).unlink(missing_ok=True)
+            return
+        self.remove_preview_layer()
+        layer = QgsRasterLayer(result, "Preview")
+        # on_layers_added skips it
+        self.preview_layer_id = layer.id()
+        QgsProject.instance().addMapLayer(layer)
+
+    def remove_preview_layer(self):
+        if self.preview_layer_id is None:
+            return
+        layer = QgsProject.instance().mapLayer(self.preview_layer_id)
+        self.preview_layer_id = None
+        if layer is None:
+            return
+        filename = layer.publicSource()
+        QgsProject.instance().removeMapLayer(layer.id())
+        try:
+            Path(filename).unlink(missing_ok=True)
+        except OSError as e:
+            QgsMessageLog.logMessage(f"Couldn't delete the previous preview {filename}: {e}", TAG, Qgis.Warning)
+
+    def utility_preview(self, layer):
+        """{"counts", "curve"}: the layer histogram within the current extent (see compute_histogram) and its current
+        utility function at the bins centers. None while the histogram is calculated in the background, cached per
+        (layer, extent) so editing the utility function doesn't read the raster again"""
+        if layer.min is None or layer.max is None:
+            # the layer info task is still scanning the raster, its row is repainted when done
+            return None
+        key = (layer.filepath, self.histogram_bbox(layer))
+        if key not in self.histograms:
+            self.request_histogram(layer, key)
+            return None
+        histogram = self.histograms[key]
+        if histogram is None or histogram["min"] is None:
+            return None
+        method, minimum, maximum, func_values = get_normalization_args(layer)
+        curve = utility_curve(histogram, method, func_values, minimum, maximum)
+        return {"counts": histogram["counts"], "curve": curve}
+
+    def histogram_bbox(self, layer):
+        """bbox of the current extent, None for the whole raster"""
+        extent = self.histogram_extent
+        if extent is None or layer.extent is None or extent.contains(layer.extent):
+            return None
+        return extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()
+
+    def request_histogram(self, layer, key):
+        """Background histogram task, an extent stats task so the ones of older extents are cancelled"""
+        if key in self.pending_histograms:
+            return
+        if len(self.histograms) >= HISTOGRAM_CACHE_SIZE:
+            self.histograms.clear()
+        task = QgsTask.fromFunction(
+            f"Histogram of raster {layer.name}",
+            get_histogram_task,
+            filename=key[0],
+            bbox=key[1],
+            on_finished=partial(self.set_histogram_on_fin, key),
+        )
+        self.pending_histograms[key] = task
+        self.add_stats_task(task, "extent", [layer])
+
+    def set_histogram_on_fin(self, key, exception, result=None):
+        task = self.pending_histograms.pop(key, None)
+        try:
+            canceled = task is not None and task.isCanceled()
+        except RuntimeError:
+            # already deleted
+            canceled = False
+        if canceled:
+            # requested again on the next paint
+            return
+        if exception:
+            QgsMessageLog.logMessage(f"Histogram of {key[0]} failed: {exception}", tag=TAG, level=Qgis.Warning)
+            # not retried on every paint
+            self.histograms[key] = None
+        else:
+            # {"empty": True}: the extent doesn't intersect the raster
+            self.histograms[key] = None if result is None or result.get("empty") else result
+        for row, layer in enumerate(self.layers):
+            if layer.filepath == key[0]:
+                self.dataChanged.emit(self.index(row, 5), self.index(row, 5))
+
+    def calc_extent_minmax(self, extent, approximate=False, refine=True):
+        """Min & max of the rasters inside the extent, all reduced together in one background task. approximate reads
+        the rasters overviews (built on demand), then if refine an exact task updates the rasters whose values differ"""
+        self.histogram_extent = extent
+        # histograms of the previous extent, the rows request the current ones when repainted
+        current = {(layer.filepath, self.histogram_bbox(layer)) for layer in self.layers}
+        for key, task in list(self.pending_histograms.items()):
+            if key not in current:
+                self.cancel_stats_task(task)
+        if self.layers:
+            self.dataChanged.emit(self.index(0, 5), self.index(len(self.layers) - 1, 5))
+        rasters = []
         for raster in self.layers:
+            if raster.extent is None:
+                QgsMessageLog.logMessage(f"{raster.name} extent is still loading, skipping", TAG, Qgis.Warning)
+                continue
             if extent.contains(raster.extent):
                 self.restore_minmax()
                 QgsMessageLog.logMessage("Extent contains raster, restoring file min, max", TAG, Qgis.Info)
@@ -599,18 +1015,52 @@ class Model(QtCore.QAbstractItemModel):
             if extent.intersect(raster.extent).isEmpty():
                 QgsMessageLog.logMessage("No intersection between the extents.", TAG, Qgis.Warning)
                 continue
-            task = QgsTask.fromFunction(
-                "Get min & max from extent of raster " + raster.name,
-                get_minmax_task,
-                raster=raster,
-                extent=extent,
-                on_finished=partial(self.set_minmax_on_fin, raster),
-            )
-            self.tasks[task] = task.status()
-            QgsApplication.taskManager().addTask(task)
-            # print(f"Model.calc_extent_minmax: task {raster.name=}, {task=}")
-            QgsMessageLog.logMessage(f"Task sent: {task.description()}", TAG, Qgis.Info)
-        # print("Model.calc_extent_minmax 1")
+            rasters += [raster]
+        if not rasters:
+            return
+        bbox = [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()]
+        self.start_extent_minmax_task(rasters, bbox, approximate=approximate, refine=approximate and refine)
+
+    def start_extent_minmax_task(self, rasters, bbox, approximate=False, refine=False, previous=None):
+        """previous results (of the approximate task) are skipped when the exact ones are the same"""
+        task = QgsTask.fromFunction(
+            f"Get {'approximate ' if approximate else ''}min & max from extent of {len(rasters)} rasters",
+            get_extent_minmax_task,
+            filepaths=[raster.filepath for raster in rasters],
+            names=[raster.name for raster in rasters],
+            bbox=bbox,
+            approximate=approximate,
+            on_finished=partial(
+                self.set_extent_minmax_on_fin, self.stats_generations["extent"], rasters, bbox, refine, previous
+            ),
+        )
+        self.add_stats_task(task, "extent", rasters)
+        QgsMessageLog.logMessage(f"Task sent: {task.description()}", TAG, Qgis.Info)
+
+    def set_extent_minmax_on_fin(self, generation, rasters, bbox, refine, previous, exception, results=None):
+        if self.is_stale("extent", generation):
+            return
+        if exception:
+            QgsMessageLog.logMessage(f"Extent min & max failed: {exception}", TAG, Qgis.Warning)
+            return
+        if results is None:
+            # canceled
+            return
+        for raster, result, old in zip(rasters, results, previous or [None] * len(rasters)):
+            # the layer may have been removed or the model reset meanwhile
+            if result is None or not any(layer is raster for layer in self.layers):
+                continue
+            if old is not None and (old["min"], old["max"]) == (result["min"], result["max"]):
+                continue
+            if old is not None:
+                QgsMessageLog.logMessage(
+                    f"{raster.name} refined min & max {old['min']}, {old['max']} -> {result['min']}, {result['max']}",
+                    TAG,
+                    Qgis.Info,
+                )
+            self.set_minmax_on_fin(raster, None, result["min"], result["max"])
+        if refine:
+            self.start_extent_minmax_task(rasters, bbox, previous=results)
 
     def set_minmax_on_fin(self, raster, _, min_, max_):
         # print("Model.set_minmax_on_fin 0 {raster.name=}")
@@ -643,73 +1093,115 @@ class Model(QtCore.QAbstractItemModel):
     def restore_minmax(self):
         # print("Model:restore_minmax 0")
         for raster in self.layers:
-            any_change = False
-            for util_func in raster.util_funcs:
-                if "percent" in util_func["name"]:
-                    continue
-                for name, params in util_func["params"].items():
-                    if "min" in params:
-                        # params["min"] = min_
-                        uf_id = raster.util_funcs.index(util_func)
-                        raster.util_funcs[uf_id]["params"][name]["min"] = raster.min
-                        any_change = True
-                    if "max" in params:
-                        # params["max"] = max_
-                        uf_id = raster.util_funcs.index(util_func)
-                        raster.util_funcs[uf_id]["params"][name]["max"] = raster.max
-                        any_change = True
-            if any_change:
+            if self.restore_layer_minmax(raster):
                 index = self.index(self.layers.index(raster), 4)
                 self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
                 self.layoutChanged.emit()
         # print("Model:restore_minmax 1")
 
+    @staticmethod
+    def restore_layer_minmax(raster):
+        """Sets the raster min & max as the min/max of its utility functions params, True if any changed"""
+        if raster.min is None or raster.max is None:
+            # still loading
+            return False
+        any_change = False
+        for util_func in raster.util_funcs:
+            if "percent" in util_func["name"]:
+                continue
+            for name, params in util_func["params"].items():
+                if "min" in params:
+                    # params["min"] = min_
+                    uf_id = raster.util_funcs.index(util_func)
+                    raster.util_funcs[uf_id]["params"][name]["min"] = raster.min
+                    any_change = True
+                if "max" in params:
+                    # params["max"] = max_
+                    uf_id = raster.util_funcs.index(util_func)
+                    raster.util_funcs[uf_id]["params"][name]["max"] = raster.max
+                    any_change = True
+        return any_change
+
 
-def get_minmax_task(task, raster, extent):
-    # f"Model.calc_extent_minmax.get_minmax_task:0 {raster.name=}, {str(extent)=}", TAG, Qgis.Info
+def get_extent_minmax_task(task, filepaths, names, bbox, approximate=False):
+    """Streams the bbox window of every raster (or of its overviews if approximate) through the compute_windows_minmax
+    shared thread pool, logging each raster as it completes"""
     QgsMessageLog.logMessage(f"Task {task.description()} start!", TAG, Qgis.Info)
-    try:
-        min_, max_ = get_minmax_with_gdal_open(raster, extent)
-    except RuntimeError:
-        QgsMessageLog.logMessage(
-            f"Task {task.description()} failed, raster doesn't fit in memory! Trying gdal_calc...", TAG, Qgis.Warning
-        )
-        try:
-            min_, max_ = get_minmax_with_gdal_calc(raster.filepath, extent)
-        except RuntimeError:
-            QgsMessageLog.logMessage(
-                f"Task {task.description()} gdal_cal failed! Try selecting a polygon feature instead..." + raster.name,
-                TAG,
-                Qgis.Warning,
-            )
-            return None, None
-    QgsMessageLog.logMessage(f"Task {task.description()} got {min_=}, {max_=}", TAG, Qgis.Info)
-    return min_, max_
 
+    def progress(index, window_fraction, total_fraction):
+        task.setProgress(100 * total_fraction)
+        if window_fraction == 1:
+            QgsMessageLog.logMessage(f"Task {task.description()}: {names[index]} done", TAG, Qgis.Info)
+        return not task.isCanceled()
+
+    results = compute_windows_minmax(
+        [(filepath, bbox) for filepath in filepaths],
+        threads=EXTENT_STATS_THREADS,
+        progress=progress,
+        approximate=approximate,
+    )
+    if results is not None:
+        for name, result in zip(names, results):
+            QgsMessageLog.logMessage(f"Task {task.description()}: {name} got {result}", TAG, Qgis.Info)
+    return results
 
-def get_file_info(filename, force=True):
-    # try:
-    dataset = Open(filename, GA_ReadOnly)
-    # except RuntimeError as e:
-    #     if "not recognized as a supported file format" in str(e):
-    #         raise FileNotFoundError("not recognized as a supported file format " + filename)
-    if dataset is None:
-        raise FileNotFoundError(filename)
-    # extent
-    geotransform = dataset.GetGeoTransform()
-    x_size = dataset.RasterXSize
-    y_size = dataset.RasterYSize
-    x_min, y_max = ApplyGeoTransform(geotransform, 0, 0)
-    x_max, y_min = ApplyGeoTransform(geotransform, x_size, y_size)
-    extent = QgsRectangle(x_min, y_min, x_max, y_max)
-    raster_band = dataset.GetRasterBand(1)
-    # max min
-    rmin = raster_band.GetMinimum()
-    rmax = raster_band.GetMaximum()
-    if not rmin or not rmax or force:
-        (rmin, rmax) = raster_band.ComputeRasterMinMax(True)
-    #
-    return rmin, rmax, extent
+
+def get_zonal_minmax_task(task, filepaths, geometries):
+    """Min & max of every raster inside the selected polygons, rasterized once per grid (see compute_zonal_minmax)"""
+
+    def progress(total_fraction):
+        task.setProgress(100 * total_fraction)
+        return not task.isCanceled()
+
+    return compute_zonal_minmax(filepaths, geometries, threads=EXTENT_STATS_THREADS, progress=progress)
+
+
+def get_preview_task(task, rasters, bbox, width, height):
+    """compute_preview into a new temporary file"""
+
+    def progress(fraction):
+        task.setProgress(100 * fraction)
+        return not task.isCanceled()
+
+    outfile = NamedTemporaryFile(suffix=".tif", delete=False).name
+    if compute_preview(rasters, bbox, width, height, outfile, progress=progress) is None:
+        Path(outfile).unlink(missing_ok=True)
+        return None
+    return outfile
+
+
+def get_histogram_task(task, filename, bbox):
+    """compute_histogram, {"empty": True} if bbox doesn't intersect the raster (a falsy result would be reported as
+    canceled)"""
+    return compute_histogram(filename, bbox=bbox) or {"empty": True}
+
+
+def get_file_info_task(task, filename):
+    return get_file_info(filename)
+
+
+def get_file_info(filename, force=False):
+    """Band 1 minimum, maximum & extent, from the persistent statistics cache (force rescans the raster)"""
+    stats = get_raster_stats(filename, force=force)
+    extent = QgsRectangle(*stats["extent"])
+    return stats["min"], stats["max"], extent
+
+
+def get_normalization_args(raster):
+    """Returns the current utility function name, the minimum & maximum to send to the normalization backend (None
+    means calculate them from the whole raster) and the list of utility function param values"""
+    util_func = raster.util_funcs[raster.uf_idx]
+    method = util_func["name"]
+    params = util_func["params"]
+    # don't need minmax
+    if method in MINMAX_METHODS:
+        minimum, maximum = None, None
+    elif len(params) > 0:
+        first = list(params.values())[0]
+        minimum, maximum = first["min"], first["max"]
+    else:
+        minimum, maximum = None, None
+    return method, minimum, maximum, [param["value"] for param in params.values()]
 
 
 def clean_str(astring: str):
@@ -732,90 +1224,3 @@ def add_metadata(filename, metadata):
     dataset.FlushCache()
     dataset = None
 
-
-def get_minmax_with_gdal_calc(filename, extent=None):
-    """
-    Get the minimum and maximum values of a raster using gdal_calc.
-    This works reading large rasters in chunks, so it is not memory intensive.
-
-    :param filename: Path to the raster file.
-    :param extent: QgsRectangle object defining the extent to calculate min/max.
-    :return: Tuple of (min_value, max_value) within the extent.
-    """
-
-    # minx maxy maxx miny
-    rextent = [extent.xMinimum(), extent.yMaximum(), extent.xMaximum(), extent.yMinimum()]
-
-    outfile = NamedTemporaryFile(prefix="pan_europeo_minmax_extent_", suffix=".tif", delete=False).name
-
-    Calc(
-        calc=["numpy.min(A)", "numpy.max(A)"],
-        A=filename,
-        outfile=outfile,
-        projwin=rextent,
-        overwrite=True,
-        # quiet=True,
-    )
-
-    dataset = Open(outfile)
-    if dataset is None:
-        raise FileNotFoundError(f"Raster file not found: {outfile}")
-    band_min = dataset.GetRasterBand(1)
-    band_max = dataset.GetRasterBand(2)
-    array_min = band_min.ReadAsArray()
-    array_max = band_max.ReadAsArray()
-    min_value = array_min[0, 0]
-    max_value = array_max[0, 0]
-
-    return min_value, max_value
-
-
-def get_minmax_with_gdal_open(raster, extent):
-    """
-    Get the minimum and maximum values of a raster using GDAL and NumPy.
-    This reads the raster in memory so it is not memory efficient for large rasters, use with try/catch.
-
-    :param filename: Path to the raster file.
-    :param extent: QgsRectangle object defining the extent to calculate min/max.
-    :return: Tuple of (min_value, max_value) within the extent.
-    """
-    # print("get_minmax_with_gdal_open 0")
-
-    dataset = Open(raster.filepath, GA_ReadOnly)
-    if dataset is None:
-        raise FileNotFoundError(f"Raster file not found: {raster.filepath}")
-    geotransform = dataset.GetGeoTransform()
-    band = dataset.GetRasterBand(1)
-    nodata = band.GetNoDataValue()
-    x_size = dataset.RasterXSize
-    y_size = dataset.RasterYSize
-
-    intersection = extent.intersect(raster.extent)
-    inv_geotransform = InvGeoTransform(geotransform)
-    if not inv_geotransform:
-        raise RuntimeError("Failed to invert geotransform.")
-    x_min, y_min = ApplyGeoTransform(inv_geotransform, intersection.xMinimum(), intersection.yMaximum())
-    x_max, y_max = ApplyGeoTransform(inv_geotransform, intersection.xMaximum(), intersection.yMinimum())
-
-    x_off = int(x_min)
-    y_off = int(y_min)
-    win_xsize = int(x_max - x_min)
-    win_ysize = int(y_max - y_min)
-
-    # avoid reading outside raster bounds
-    # TODO can't read outside as it's intersecting first?
-    adjusted_win_xsize = min(win_xsize, x_size - x_off)
-    adjusted_win_ysize = min(win_ysize, y_size - y_off)
-
-    # Read the data within the intersection as a NumPy array
-    array = band.ReadAsArray(x_off, y_off, adjusted_win_xsize, adjusted_win_ysize)
-    if array is None:
-        raise ValueError("Failed to read raster data within the specified extent.")
-    # filter nodata
-    data = array[(array != nodata) & ~isnan(array)]
-    if data.size > 0:
-        # print("get_minmax_with_gdal_open 1")
-        return np_min(data), np_max(data)
-    else:
-        # print("get_minmax_with_gdal_open 1")
-        return None, None
@@ -0,0 +1,126 @@
+# python3
+"""
+Content addressed cache of the normalized rasters written by Model.doit
+
+A normalized raster is identified by its input file (path, size & modification time), utility function method, params,
+min & max, projwin, output type and nodata. Re-running with only the weights changed reuses every normalized raster and
+only runs the weighted sum.
+
+Files, in:
+    $PAN_EUROPEO_NORM_CACHE, else
+    $XDG_CACHE_HOME/pan-europeo/normalized, else
+    ~/.cache/pan-europeo/normalized
+are:
+    {key}.tif   written by the normalizator task
+    {key}.json  written when that task succeeded, a .tif without it is never used; its modification time is the last
+                use, the least recently used entries are evicted when the cache exceeds $PAN_EUROPEO_NORM_CACHE_SIZE
+                bytes (MAX_BYTES by default)
+"""
+import json
+import os
+import time
+from hashlib import sha1
+from pathlib import Path
+
+from ..stats_cache import cache_key as file_key
+
+# default size limit of the cache
+MAX_BYTES = 4 * 2**30
+
+
+def cache_dir() -> Path:
+    if directory := os.environ.get("PAN_EUROPEO_NORM_CACHE"):
+        return Path(directory)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "pan-europeo" / "normalized"
+
+
+def max_bytes() -> int:
+    try:
+        return int(os.environ.get("PAN_EUROPEO_NORM_CACHE_SIZE", MAX_BYTES))
+    except ValueError:
+        return MAX_BYTES
+
+
+def norm_key(filename, method, params, minimum, maximum, projwin, rtype, no_data):
+    """None if the input file can't be identified (not a local file)"""
+    identity = file_key(filename)
+    if identity is None:
+        return None
+    if projwin is not None and not projwin.isNull():
+        projwin = [projwin.xMinimum(), projwin.yMinimum(), projwin.xMaximum(), projwin.yMaximum()]
+    else:
+        projwin = None
+    fields = [identity, method, list(params), minimum, maximum, projwin, rtype, no_data]
+    return sha1(json.dumps(fields, default=str).encode()).hexdigest()
+
+
+def raster_file(key) -> Path:
+    return cache_dir() / f"{key}.tif"
+
+
+def lookup(key):
+    """The cached normalized raster path, marking it as just used; None if missing"""
+    if key is None:
+        return None
+    marker = cache_dir() / f"{key}.json"
+    raster = raster_file(key)
+    if not (marker.is_file() and raster.is_file()):
+        return None
+    try:
+        os.utime(marker)
+    except OSError:
+        pass
+    return str(raster)
+
+
+def output_file(key) -> str:
+    """Where the normalizator task writes the raster of key, commit it once written"""
+    directory = cache_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f"{key}.json").unlink(missing_ok=True)
+    return str(raster_file(key))
+
+
+def commit(key, description=""):
+    """Marks the raster of key as complete"""
+    marker = cache_dir() / f"{key}.json"
+    try:
+        with open(marker, "w") as f:
+            json.dump({"description": description, "created": time.time()}, f)
+    except OSError as e:
+        print(f"norm_cache: couldn't write {key=}, {e}")
+
+
+def evict(keep=()):
+    """Deletes the least recently used entries (and incomplete rasters) until the cache fits max_bytes, except the
+    keys to keep; returns the number of entries deleted"""
+    directory = cache_dir()
+    if not directory.is_dir():
+        return 0
+    entries = []
+    for raster in directory.glob("*.tif"):
+        key = raster.stem
+        files = [raster, *directory.glob(f"{key}.tif.*")]
+        size = sum(f.stat().st_size for f in files if f.is_file())
+        marker = directory / f"{key}.json"
+        # incomplete (failed or being written) rasters age from their last write
+        used = (marker if marker.is_file() else raster).stat().st_mtime
+        entries += [(used, key, size, files + [marker])]
+    total = sum(size for _, _, size, _ in entries)
+    deleted = 0
+    for used, key, size, files in sorted(entries):
+        if total <= max_bytes():
+            break
+        if key in keep:
+            continue
+        try:
+            for f in files:
+                f.unlink(missing_ok=True)
+        except OSError as e:
+            # such as a raster loaded in the project on windows
+            print(f"norm_cache: couldn't evict {key=}, {e}")
+            continue
+        total -= size
+        deleted += 1
+    return deleted
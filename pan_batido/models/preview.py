@@ -0,0 +1,89 @@
+# python3
+"""
+Low resolution weighted sum of the normalized rasters, at the map canvas resolution
+
+Each raster window is read decimated straight into the canvas sized buffer (ReadAsArray buf_xsize & buf_ysize, gdal
+picks the closest overview), so the cost depends on the canvas pixels, not on the rasters size. The formulas are the
+shared normalization expressions, nodata adds 0 to the sum as in gdal_calc_normsum.
+"""
+from numpy import arange, float32, nan, nan_to_num, zeros
+from osgeo.gdal import ApplyGeoTransform, GA_ReadOnly, GDT_Float32, GetDriverByName, Open  # type: ignore
+
+from ..normalization import MINMAX_METHODS, evaluate
+from ..stats_cache import get_raster_stats, pixel_window, valid_mask
+
+
+def utility_curve(histogram, method, params=(), minimum=None, maximum=None):
+    """The utility function at the centers of the compute_histogram bins, None minimum & maximum are the histogram
+    (whole raster) ones"""
+    bins = len(histogram["counts"])
+    step = (histogram["max"] - histogram["min"]) / bins
+    centers = (histogram["min"] + step * (arange(bins) + 0.5)).astype(float32)
+    minimum = histogram["min"] if minimum is None else minimum
+    maximum = histogram["max"] if maximum is None else maximum
+    return nan_to_num(evaluate(centers, method, params, minimum, maximum), nan=0, posinf=1, neginf=0)
+
+
+def output_window(geotransform, window, bbox, width, height):
+    """(col_off, row_off, cols, rows) of the width x height bbox grid covered by the raster window; None if it's
+    smaller than a canvas pixel"""
+    x_min, y_max = ApplyGeoTransform(geotransform, window[0], window[1])
+    x_max, y_min = ApplyGeoTransform(geotransform, window[0] + window[2], window[1] + window[3])
+    x_res = (bbox[2] - bbox[0]) / width
+    y_res = (bbox[3] - bbox[1]) / height
+    col_off = max(0, round((min(x_min, x_max) - bbox[0]) / x_res))
+    col_end = min(width, round((max(x_min, x_max) - bbox[0]) / x_res))
+    row_off = max(0, round((bbox[3] - max(y_min, y_max)) / y_res))
+    row_end = min(height, round((bbox[3] - min(y_min, y_max)) / y_res))
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return col_off, row_off, col_end - col_off, row_end - row_off
+
+
+def compute_preview(rasters, bbox, width, height, outfile, progress=None):
+    """Weighted sum of the normalized rasters over bbox [xmin, ymin, xmax, ymax] (in the rasters crs) as a width x
+    height Float32 GTiff outfile, nan outside every raster.
+
+    rasters: list of (filename, method, params, minimum, maximum, weight), None minimum & maximum are read from the
+    statistics cache
+    progress: called with the done fraction, returning False cancels (returns None)
+    """
+    result = zeros((height, width), dtype=float32)
+    covered = zeros((height, width), dtype=bool)
+    projection = ""
+    for i, (filename, method, params, minimum, maximum, weight) in enumerate(rasters):
+        if method in MINMAX_METHODS and (minimum is None or maximum is None):
+            stats = get_raster_stats(filename)
+            minimum = stats["min"] if minimum is None else minimum
+            maximum = stats["max"] if maximum is None else maximum
+        dataset = Open(filename, GA_ReadOnly)
+        if dataset is None:
+            raise FileNotFoundError(filename)
+        projection = projection or dataset.GetProjection()
+        geotransform = dataset.GetGeoTransform()
+        window = pixel_window(geotransform, (dataset.RasterXSize, dataset.RasterYSize), bbox)
+        if window is not None and (target := output_window(geotransform, window, bbox, width, height)):
+            col_off, row_off, cols, rows = target
+            band = dataset.GetRasterBand(1)
+            data = band.ReadAsArray(*window, buf_xsize=cols, buf_ysize=rows).astype(float32)
+            mask = valid_mask(data, band.GetNoDataValue())
+            norm = evaluate(data, method, params, minimum, maximum)
+            norm[~mask] = 0
+            result[row_off : row_off + rows, col_off : col_off + cols] += weight * norm
+            covered[row_off : row_off + rows, col_off : col_off + cols] = True
+        dataset = None
+        if progress and progress((i + 1) / len(rasters)) is False:
+            return None
+    result[~covered] = nan
+    x_res = (bbox[2] - bbox[0]) / width
+    y_res = (bbox[3] - bbox[1]) / height
+    dataset = GetDriverByName("GTiff").Create(outfile, width, height, 1, GDT_Float32)
+    dataset.SetGeoTransform([bbox[0], x_res, 0, bbox[3], 0, -y_res])
+    dataset.SetProjection(projection)
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(nan)
+    band.WriteArray(result)
+    dataset.FlushCache()
+    dataset = None
+    return outfile
+
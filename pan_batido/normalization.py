@@ -0,0 +1 @@
+../normalization.py
\ No newline at end of file
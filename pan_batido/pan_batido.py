@@ -29,6 +29,7 @@
 """
 import os.path
 from functools import partial
+from time import perf_counter
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 
@@ -195,10 +196,16 @@ class Marraqueta:
         # Only create GUI ONCE in callback, so that it will only load when the plugin is started
         if self.first_start == True:
             self.first_start = False
+            start = perf_counter()
             self.context = QgsProcessingContext()
             self.context.setProject(QgsProject.instance())
             self.model = Model(iface=self.iface, context=self.context)
+            model_time = perf_counter() - start
             self.dlg = Dialog(iface=self.iface, model=self.model)
+            # startup benchmark
+            QgsMessageLog.logMessage(
+                f"Dialog created in {perf_counter() - start:.3f}s (model {model_time:.3f}s)", tag=TAG, level=Qgis.Info
+            )
             print("===Dialog created===")
         else:
             print("===Dialog already===")
@@ -0,0 +1 @@
+../stats_cache.py
\ No newline at end of file
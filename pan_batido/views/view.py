@@ -22,14 +22,12 @@
  ***************************************************************************/
 """
 import os
-from functools import partial
+from functools import cache, partial
 
 import numpy as np
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from matplotlib.figure import Figure
 from osgeo_utils.gdal_calc import GDALDataTypeNames  # type: ignore
-from PyQt5.QtCore import QUrl
-from PyQt5.QtGui import QDesktopServices
+from PyQt5.QtCore import QPointF, QRectF, QUrl
+from PyQt5.QtGui import QDesktopServices, QPainter, QPen, QPixmap, QPolygonF
 from qgis.core import Qgis, QgsCoordinateTransform, QgsProject, QgsRectangle, QgsVectorLayer  # type: ignore
 from qgis.gui import QgsDoubleSpinBox, QgsMessageBar  # type: ignore
 from qgis.PyQt import QtWidgets, uic  # type: ignore
@@ -39,6 +37,8 @@ from .double_spin_slider import DoubleSpinSlider
 
 TITLE = "Pan-Europeo"
 DURATION = 3
+# painted cells kept by each delegate, the cache is cleared when full
+PIXMAP_CACHE_SIZE = 512
 
 
 def breakit():
@@ -75,6 +75,7 @@ class Dialog(QtWidgets.QDialog, FORM_CLASS):  # type: ignore
         self.tree.setItemDelegateForColumn(2, WeightDoubleSpinSliderDelegate(self))
         self.tree.setItemDelegateForColumn(3, UtilityFuncComboBoxDelegate(self))
         self.tree.setItemDelegateForColumn(4, SliderListDelegate(self))
+        self.tree.setItemDelegateForColumn(5, UtilityPreviewDelegate(self))
         self.model.restore_minmax()
         # buttons
         self.button_box.button(QtWidgets.QDialogButtonBox.Apply).clicked.connect(lambda: self.on_apply())
@@ -98,6 +99,10 @@ class Dialog(QtWidgets.QDialog, FORM_CLASS):  # type: ignore
         self.iface.mapCanvas().selectionChanged.connect(self.on_iface_selection_changed_update_extent_group_box)
         # Disable the load-normalized checkbox when skip normalization is toggled
         self.checkBox_skip_normalization.toggled.connect(self.on_skip_normalization_toggled)
+        self.checkBox_fused.toggled.connect(self.on_fused_toggled)
+        # refining only applies to approximate statistics
+        self.checkBox_approx_stats.toggled.connect(self.checkBox_refine_stats.setEnabled)
+        self.checkBox_preview.toggled.connect(self.model.set_preview)
 
         self.init_graphics_view()
 
@@ -109,21 +114,33 @@ class Dialog(QtWidgets.QDialog, FORM_CLASS):  # type: ignore
             self.checkBox_load_normalized.setChecked(False)
             self.checkBox_load_normalized.setEnabled(False)
         else:
-            self.checkBox_load_normalized.setEnabled(True)
+            self.checkBox_load_normalized.setEnabled(not self.checkBox_fused.isChecked())
+
+    def on_fused_toggled(self, checked):
+        """Handle the toggling of the single pass checkbox.
+        If checked, disable the load normalized checkbox as no intermediate normalized rasters are written.
+        """
+        if checked:
+            self.checkBox_load_normalized.setChecked(False)
+        self.checkBox_load_normalized.setEnabled(not checked and not self.checkBox_skip_normalization.isChecked())
 
     def init_graphics_view(self):
-        """Initialize the QGraphicsView with a matplotlib plot."""
-        # Create a matplotlib figure and canvas
-        fig = Figure(figsize=(12, 3))
-        canvas = FigureCanvas(fig)
-        utility_functions(fig)
-
-        # Embed the canvas into the QGraphicsView
-        scene = QtWidgets.QGraphicsScene(self)
-        proxy_widget = QtWidgets.QGraphicsProxyWidget()
-        proxy_widget.setWidget(canvas)
-        scene.addItem(proxy_widget)
-        self.graphicsView.setScene(scene)
+        """Initialize the QGraphicsView, the matplotlib plot is drawn when its panel is first expanded"""
+        self.graphicsView.setScene(QtWidgets.QGraphicsScene(self))
+        if self.mGroupBox_2.isCollapsed():
+            self.mGroupBox_2.collapsedStateChanged.connect(self.on_graphics_panel_collapsed)
+        else:
+            self.draw_graphics_view()
+
+    def on_graphics_panel_collapsed(self, collapsed):
+        if not collapsed:
+            self.mGroupBox_2.collapsedStateChanged.disconnect(self.on_graphics_panel_collapsed)
+            self.draw_graphics_view()
+
+    def draw_graphics_view(self):
+        pixmap = QPixmap()
+        pixmap.loadFromData(utility_functions_png(), "PNG")
+        self.graphicsView.scene().addPixmap(pixmap)
 
     def on_apply(self):
         self.model.balance_weights()
@@ -137,6 +154,8 @@ class Dialog(QtWidgets.QDialog, FORM_CLASS):  # type: ignore
             projwin=self.mExtentGroupBox.outputExtent(),
             outfile=self.fileWidget.filePath(),
             skip_normalization=self.checkBox_skip_normalization.isChecked(),
+            fused=self.checkBox_fused.isChecked(),
+            memory_budget=self.lineEdit_memory_budget.text().strip() or None,
         )
         text = "The main calculation task has been sent to the background."
         level = Qgis.Info  # Options: Qgis.Info, Qgis.Warning, Qgis.Critical
@@ -174,7 +193,11 @@ class Dialog(QtWidgets.QDialog, FORM_CLASS):  # type: ignore
         """Handle the extentChanged signal from the QgsExtentGroupBox."""
         # print(f"View:on_extent_groupbox_changed 0 {extent=}")
         self.mExtentGroupBox.blockSignals(True)
-        self.model.calc_extent_minmax(extent)
+        self.model.request_extent_minmax(
+            extent,
+            approximate=self.checkBox_approx_stats.isChecked(),
+            refine=self.checkBox_refine_stats.isChecked(),
+        )
         self.mExtentGroupBox.blockSignals(False)
         text = "The extent change triggered min-max calculations background tasks."
         level = Qgis.Info  # Options: Qgis.Info, Qgis.Warning, Qgis.Critical
@@ -233,7 +256,62 @@ def revalue_double_spin_box(spin):
     return spin.value()
 
 
-class WeightDoubleSpinSliderDelegate(QtWidgets.QStyledItemDelegate):
+class PixmapCacheDelegate(QtWidgets.QStyledItemDelegate):
+    """Renders the cell widget (see render_widget) once into a pixmap keyed by row, column, value, size & style state,
+    so repainting the same cell is a blit. The pixmaps of a cell are dropped when the model changes its data"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pixmaps = {}
+        parent.model.dataChanged.connect(self.on_data_changed)
+        parent.model.layoutChanged.connect(self.pixmaps.clear)
+        parent.model.modelReset.connect(self.pixmaps.clear)
+
+    def render_widget(self, value):
+        """Returns a (hidden) widget showing value"""
+        raise NotImplementedError
+
+    def cache_value(self, value):
+        """Hashable value for the cache key"""
+        return value
+
+    def paint(self, painter, option, index):
+        value = index.model().data(index, Qt.EditRole)
+        if not value:
+            super().paint(painter, option, index)
+            return
+        ratio = painter.device().devicePixelRatioF()
+        state = QtWidgets.QStyle.State_Enabled | QtWidgets.QStyle.State_Selected | QtWidgets.QStyle.State_Active
+        key = (
+            index.row(),
+            index.column(),
+            self.cache_value(value),
+            option.rect.width(),
+            option.rect.height(),
+            int(option.state & state),
+            ratio,
+        )
+        if (pixmap := self.pixmaps.get(key)) is None:
+            if len(self.pixmaps) >= PIXMAP_CACHE_SIZE:
+                self.pixmaps.clear()
+            pixmap = QPixmap(option.rect.size() * ratio)
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(Qt.transparent)
+            widget = self.render_widget(value)
+            widget.setGeometry(option.rect)
+            widget.render(pixmap)
+            widget.deleteLater()
+            self.pixmaps[key] = pixmap
+        painter.drawPixmap(option.rect.topLeft(), pixmap)
+
+    def on_data_changed(self, top_left, bottom_right, roles=()):
+        rows = range(top_left.row(), bottom_right.row() + 1)
+        columns = range(top_left.column(), bottom_right.column() + 1)
+        for key in [key for key in self.pixmaps if key[0] in rows and key[1] in columns]:
+            del self.pixmaps[key]
+
+
+class WeightDoubleSpinSliderDelegate(PixmapCacheDelegate):
     def createEditor(self, parent, option, index):
         value = index.model().data(index, Qt.EditRole)
         editor = DoubleSpinSlider(parent=parent)
@@ -254,37 +332,16 @@ class WeightDoubleSpinSliderDelegate(QtWidgets.QStyledItemDelegate):
     def updateEditorGeometry(self, editor, option, index):
         editor.setGeometry(option.rect)
 
-    def paint(self, painter, option, index):
-        if value := index.model().data(index, Qt.EditRole):
-            # widget = QtWidgets.QWidget()
-            # layout = QtWidgets.QBoxLayout(widget)
-            slider = DoubleSpinSlider(parent=self.parent().tree)
-            slider.set3(0, value, 100)
-            slider.setGeometry(option.rect)
-            # layout.addWidget(slider)
-            tree = self.parent().tree
-            tree_top_left = tree.viewport().mapTo(tree, option.rect.topLeft())
-            window_top_left = tree.mapTo(tree.window(), tree_top_left)
-            slider.render(painter, window_top_left)
-            del slider
-            # widget.render(painter, window_top_left)
-            # pt = painter.deviceTransform().map(option.rect.topLeft())
-            # print(
-            #     f"weight:paint: {index.row()} t w r p",
-            #     tree_top_left,
-            #     window_top_left,
-            #     option.rect.topLeft(),
-            #     #     pt,
-            #     sep="\n",
-            # )
-        else:
-            super().paint(painter, option, index)
+    def render_widget(self, value):
+        slider = DoubleSpinSlider(parent=self.parent().tree)
+        slider.set3(0, value, 100)
+        return slider
 
     def sizeHint(self, option, index):
         return QSize(200, 40)
 
 
-class UtilityFuncComboBoxDelegate(QtWidgets.QStyledItemDelegate):
+class UtilityFuncComboBoxDelegate(PixmapCacheDelegate):
     def createEditor(self, parent, option, index):
         # print(f"ComboBoxDelegate:createEditor: {index.row()=}, {index.column()=}")
         model = index.model()
@@ -316,26 +373,16 @@ class UtilityFuncComboBoxDelegate(QtWidgets.QStyledItemDelegate):
     def sizeHint(self, option, index):
         return QSize(200, 40)
 
-    def paint(self, painter, option, index):
-        # disp = index.model().data(index, Qt.DisplayRole) ALWAYS NULL ?? incluso con model.setData DisplayRole ?
-        # edit = index.model().data(index, Qt.EditRole)
-        # print(f"ComboBoxDelegate:print: {index.row()=}, {index.column()=}, {disp=}, {edit=}")
-        if value := index.model().data(index, Qt.EditRole):
-            idx = value["idx"]
-            description = value["cb"][idx]["description"]
-            combo = QtWidgets.QComboBox(parent=self.parent().tree)
-            combo.addItem(description)
-            combo.setGeometry(option.rect)
-            tree = self.parent().tree
-            tree_top_left = tree.viewport().mapTo(tree, option.rect.topLeft())
-            window_top_left = tree.mapTo(tree.window(), tree_top_left)
-            combo.render(painter, window_top_left)
-            del combo
-        else:
-            super().paint(painter, option, index)
+    def cache_value(self, value):
+        return value["cb"][value["idx"]]["description"]
+
+    def render_widget(self, value):
+        combo = QtWidgets.QComboBox(parent=self.parent().tree)
+        combo.addItem(self.cache_value(value))
+        return combo
 
 
-class SliderListDelegate(QtWidgets.QStyledItemDelegate):
+class SliderListDelegate(PixmapCacheDelegate):
     def createEditor(self, parent, option, index):
         sliders = index.model().data(index, Qt.EditRole)
         editor = QtWidgets.QWidget(parent=parent)
@@ -380,35 +427,68 @@ class SliderListDelegate(QtWidgets.QStyledItemDelegate):
         sliders = index.model().data(index, Qt.EditRole)
         return QSize(100, 40 * len(sliders))
 
+    def cache_value(self, sliders):
+        return tuple(map(tuple, sliders))
+
+    def render_widget(self, sliders):
+        editor = QtWidgets.QWidget(parent=self.parent().tree)
+        editor.setAttribute(Qt.WA_TranslucentBackground)
+        layout = QtWidgets.QVBoxLayout(editor)
+        layout.setContentsMargins(0, 0, 0, 0)
+        for text, min_, val, max_ in sliders:
+            slider = DoubleSpinSlider()
+            slider.setRange(min_, max_)
+            slider.setValue(val)
+            slider.setText(text)
+            layout.addWidget(slider)
+        return editor
+
+
+class UtilityPreviewDelegate(QtWidgets.QStyledItemDelegate):
+    """Paints the row layer histogram bars with its utility function curve on top (see Model.utility_preview)"""
+
+    def sizeHint(self, option, index):
+        return QSize(120, 40)
+
     def paint(self, painter, option, index):
-        if sliders := index.model().data(index, Qt.EditRole):
-            # print(f"SliderListDelegate:print: {index.row()}, {index.column()} {sliders=}")
-            tree = self.parent().tree
-            editor = QtWidgets.QWidget(parent=tree)
-            editor.setAttribute(Qt.WA_TranslucentBackground)
-            layout = QtWidgets.QVBoxLayout(editor)
-            layout.setContentsMargins(0, 0, 0, 0)
-            for slidx, (text, min_, val, max_) in enumerate(sliders):
-                slider = DoubleSpinSlider()
-                slider.setRange(min_, max_)
-                slider.setValue(val)
-                slider.setText(text)
-                slider.valueChanged.connect(lambda value, idx=index, sid=slidx: self.on_value_changed(value, idx, sid))
-                layout.addWidget(slider)
-
-            tree_top_left = tree.viewport().mapTo(tree, option.rect.topLeft())
-            window_top_left = tree.mapTo(tree.window(), tree_top_left)
-            # pt = painter.deviceTransform().map(option.rect.topLeft())
-            editor.setGeometry(option.rect)
-            editor.render(
-                painter,
-                window_top_left,
-                # QRegion(0, 0, option.rect.width(), option.rect.height()),
-                # QtWidgets.QWidget.RenderFlag.DrawChildren,
-            )
-            del editor
-        else:
+        preview = index.model().data(index, Qt.EditRole)
+        if not preview or not (peak := preview["counts"].max()):
             super().paint(painter, option, index)
+            return
+        rect = QRectF(option.rect.adjusted(2, 2, -2, -2))
+        width = rect.width() / len(preview["counts"])
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        brush = option.palette.mid()
+        for i, count in enumerate(preview["counts"]):
+            height = rect.height() * count / peak
+            painter.fillRect(QRectF(rect.left() + i * width, rect.bottom() - height, width, height), brush)
+        painter.setPen(QPen(option.palette.highlight().color(), 2))
+        painter.drawPolyline(
+            QPolygonF(
+                [
+                    QPointF(rect.left() + (i + 0.5) * width, rect.bottom() - rect.height() * float(utility))
+                    for i, utility in enumerate(preview["curve"])
+                ]
+            )
+        )
+        painter.restore()
+
+
+@cache
+def utility_functions_png():
+    """The utility_functions figure rendered once as PNG bytes, matplotlib is only imported here"""
+    from io import BytesIO
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(12, 3))
+    canvas = FigureCanvasAgg(fig)
+    utility_functions(fig)
+    buffer = BytesIO()
+    canvas.print_png(buffer)
+    return buffer.getvalue()
 
 
 def utility_functions(fig):
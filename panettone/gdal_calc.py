@@ -33,13 +33,20 @@
 
 import argparse
 import glob
+import math
 import os
 import os.path
+import re
 import string
 import sys
 import textwrap
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from numbers import Number
-from typing import Dict, Optional, Sequence, Tuple, Union
+from typing import Callable, Dict, NamedTuple, Optional, Sequence, Tuple, Union
 
 import numpy
 
@@ -77,6 +84,106 @@ DefaultNDVLookup = {
 # tuple of available output datatypes names
 GDALDataTypeNames = tuple(gdal.GetDataTypeName(dt) for dt in DefaultNDVLookup.keys())
 
+# global namespace for eval with all functions of gdal_array, numpy; copied by each Calc call
+DefaultNamespace = {
+    key: getattr(module, key) for module in [gdal_array, numpy] for key in dir(module) if not key.startswith("__")
+}
+
+
+@lru_cache(maxsize=256)
+def compile_calc(calc: str):
+    """Compiled calc expression, memoized so each expression is parsed once per process instead of once per block"""
+    return compile(calc, "<calc>", "eval")
+
+
+# upper bound of pixels per window when growing the windows over the inputs blocks, without a memory budget
+DefaultWindowPixels = 2**18
+
+# bytes per pixel of a block besides the inputs: float64 result plus the expression temporaries, and 2 nodata masks
+BlockOverheadBytes = 3 * 8 + 2
+
+MemoryUnits = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_memory(value: Union[int, str]) -> int:
+    """Bytes of a memory size such as 536870912, "512MB", "512M", "0.5GiB" or "2 GB" (binary units)"""
+    if isinstance(value, Number):
+        return int(value)
+    match = re.fullmatch(r"(\d+(?:\.\d*)?)\s*([KMGT]?)I?B?", value.strip().upper())
+    if not match:
+        raise ValueError(f"Invalid memory size: {value}")
+    return int(float(match.group(1)) * MemoryUnits[match.group(2)])
+
+
+def holds(dtype, value) -> bool:
+    """True if the value is exactly representable in the numpy dtype"""
+    try:
+        with numpy.errstate(all="ignore"):
+            cast = numpy.array(value).astype(dtype)
+    except (OverflowError, ValueError):
+        return False
+    if math.isnan(value):
+        return bool(numpy.isnan(cast))
+    return bool(cast == value)
+
+
+class WindowPlan(NamedTuple):
+    """Windows (xoff, yoff, xsize, ysize) in row-major order, the common window size and the I/O efficiency: requested
+    pixels over pixels of the input blocks touched (1 when every block is decoded exactly once)"""
+
+    windows: list
+    block_size: Tuple[int, int]
+    efficiency: float
+
+
+def plan_windows(
+    dimensions: Tuple[int, int], block_sizes: Sequence[Tuple[int, int]], max_pixels: int = DefaultWindowPixels
+) -> WindowPlan:
+    """Plan the block traversal of rasters of the same dimensions with possibly different natural block sizes.
+
+    The window is a multiple of every input block size (least common multiple, the whole raster side when it doesn't
+    fit), then grown by whole multiples, first along rows then along columns, while it stays under max_pixels. Windows
+    are walked in row-major order, so row striped and tiled inputs are read sequentially.
+    """
+    xsize, ysize = dimensions
+    block_sizes = [(max(1, int(bx)), max(1, int(by))) for bx, by in block_sizes] or [(xsize, 1)]
+
+    def aligned(sizes, limit):
+        common = math.lcm(*sizes)
+        return limit if common >= limit else common
+
+    step_x = aligned([bx for bx, _ in block_sizes], xsize)
+    step_y = aligned([by for _, by in block_sizes], ysize)
+    if step_x * step_y > max_pixels:
+        # alignment to all inputs doesn't fit, align to the largest block that fits (else the smallest)
+        steps = sorted({(min(bx, xsize), min(by, ysize)) for bx, by in block_sizes}, key=lambda b: b[0] * b[1])
+        step_x, step_y = next((b for b in reversed(steps) if b[0] * b[1] <= max_pixels), steps[0])
+    win_x = step_x
+    win_y = step_y
+    if win_x * win_y <= max_pixels:
+        win_x = min(xsize, max(1, max_pixels // (step_x * win_y)) * step_x)
+        win_y = min(ysize, max(1, max_pixels // (win_x * step_y)) * step_y)
+
+    windows = [
+        (x, y, min(win_x, xsize - x), min(win_y, ysize - y))
+        for y in range(0, ysize, win_y)
+        for x in range(0, xsize, win_x)
+    ]
+
+    def covered(size, win, block):
+        """pixels of the blocks touched along one axis, over all the windows"""
+        total = 0
+        for start in range(0, size, win):
+            first = start // block * block
+            last = min(size, -(-min(start + win, size) // block) * block)
+            total += last - first
+        return total
+
+    touched = sum(covered(xsize, win_x, bx) * covered(ysize, win_y, by) for bx, by in block_sizes)
+    efficiency = len(block_sizes) * xsize * ysize / touched if touched else 1.0
+    return WindowPlan(windows, (win_x, win_y), efficiency)
+
+
 """ Perform raster calculations with numpy syntax.
 Use any basic arithmetic supported by numpy arrays such as +-* along with logical
 operators such as >. Note that all files must have the same dimensions, but no projection checking is performed.
@@ -100,6 +207,15 @@ work with two bands:
 
 sum all files with hidden noDataValue
     Calc(calc="sum(a,axis=0)", a=['0.tif','1.tif','2.tif'], outfile="sum.tif", hideNoData=True)
+
+read and calculate blocks using 4 threads (0 or None for all cpus):
+    Calc(calc="A+B", A="input1.tif", B="input2.tif", outfile="result.tif", threads=4)
+
+derive the window size from a memory budget (instead of the inputs block sizes only):
+    Calc(calc="A+B", A="input1.tif", B="input2.tif", outfile="result.tif", memory_budget="512MB")
+
+report progress or cancel, gdal style callback(complete, message, data) returning 0 stops the calculation:
+    Calc(calc="A*2", A="input.tif", outfile="result.tif", callback=lambda complete, msg, data: 1)
 """
 
 
@@ -120,6 +236,11 @@ def Calc(
     user_namespace: Optional[Dict] = None,
     debug: bool = False,
     quiet: bool = False,
+    callback: Optional[Callable] = None,
+    callback_data=None,
+    threads: Optional[int] = 1,
+    memory_budget: Optional[Union[int, str]] = None,
+    prefetch: bool = True,
     **input_files,
 ):
 
@@ -141,13 +262,16 @@ def Calc(
 
     creation_options = creation_options or []
 
+    myCodes = []
+    for this_calc in calc:
+        try:
+            myCodes.append(compile_calc(this_calc))
+        except SyntaxError:
+            print(f"evaluation of calculation {this_calc} failed")
+            raise
+
     # set up global namespace for eval with all functions of gdal_array, numpy
-    global_namespace = {
-        key: getattr(module, key)
-        for module in [gdal_array, numpy]
-        for key in dir(module)
-        if not key.startswith("__")
-    }
+    global_namespace = dict(DefaultNamespace)
 
     if user_namespace:
         global_namespace.update(user_namespace)
@@ -470,23 +594,113 @@ def Calc(
         )
 
     ################################################################
+    # set up the threads reading & calculating blocks
+    ################################################################
+
+    if threads is None or threads <= 0:
+        threads = os.cpu_count() or 1
+    # gdal datasets can't be read concurrently, each worker thread opens its own, so all inputs must be reopenable
+    if threads > 1 and not all(
+        myFile.GetDescription() and myFile.GetDriver().ShortName != "MEM" for myFile in myFiles
+    ):
+        if debug:
+            print("in memory inputs can't be read by several threads, using 1 thread")
+        threads = 1
+    # the extent temp vrts are only written to disk when flushed, the workers reopen them by name
+    if threads > 1:
+        for myFile in myFiles:
+            if myFile.GetDescription() in myTempFileNames:
+                myFile.FlushCache()
+    if debug:
+        print(f"using {threads} thread(s)")
+    ################################################################
     # find block size to chop grids into bite-sized chunks
     ################################################################
 
-    # use the block size of the first layer to read efficiently
-    myBlockSize = myFiles[0].GetRasterBand(myBands[0]).GetBlockSize()
-    # find total x and y blocks to be read
-    nXBlocks = (int)((DimensionsCheck[0] + myBlockSize[0] - 1) / myBlockSize[0])
-    nYBlocks = (int)((DimensionsCheck[1] + myBlockSize[1] - 1) / myBlockSize[1])
-    myBufSize = myBlockSize[0] * myBlockSize[1]
+    # size the windows to the memory budget: every input, the result & nodata masks of each block in flight
+    if memory_budget is None:
+        myMaxPixels = DefaultWindowPixels
+    else:
+        myPixelBytes = sum(numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(dt)).itemsize for dt in myDataTypeNum)
+        myPixelBytes += BlockOverheadBytes
+        myBlocksInFlight = (2 if prefetch else 1) if threads == 1 else 3 * threads
+        myMaxPixels = max(1, parse_memory(memory_budget) // (myPixelBytes * myBlocksInFlight))
+        if debug:
+            print(f"memory budget {memory_budget}: {myPixelBytes} bytes per pixel, {myBlocksInFlight} blocks in flight")
+
+    # at least 2 windows per thread, else the threads have nothing to do
+    if threads > 1:
+        myMaxPixels = min(myMaxPixels, max(1, DimensionsCheck[0] * DimensionsCheck[1] // (2 * threads)))
+
+    # align the windows to the block size of every layer, walking them row by row
+    myBlockSizes = [myFile.GetRasterBand(myBand).GetBlockSize() for myFile, myBand in zip(myFiles, myBands)]
+    myPlan = plan_windows(DimensionsCheck, myBlockSizes, myMaxPixels)
+    # windows (xoff, yoff, xsize, ysize) to be read, in the case the blocks don't fit perfectly the final pieces are
+    # smaller
+    myWindows = myPlan.windows
 
     if debug:
-        print(f"using blocksize {myBlockSize[0]} x {myBlockSize[1]}")
+        myInterleaves = {myFile.GetMetadataItem("INTERLEAVE", "IMAGE_STRUCTURE") for myFile in myFiles} - {None}
+        print(
+            f"input blocksizes {sorted(set(map(tuple, myBlockSizes)))}, interleave {sorted(myInterleaves)}, "
+            f"using windows {myPlan.block_size[0]} x {myPlan.block_size[1]} ({len(myWindows)} row-major), "
+            f"I/O efficiency {myPlan.efficiency:.1%}"
+        )
+
+    thread_files = threading.local()
+    thread_files_opened = []
+    thread_files_lock = threading.Lock()
+
+    def get_files():
+        """input datasets usable by the current thread"""
+        if threads == 1:
+            return myFiles
+        if not hasattr(thread_files, "files"):
+            thread_files.files = [gdal.Open(myFile.GetDescription(), gdal.GA_ReadOnly) for myFile in myFiles]
+            with thread_files_lock:
+                thread_files_opened.append(thread_files.files)
+        return thread_files.files
+
+    # prefetch double buffer, slot 0 & 1 arrays per alpha or input
+    slot_buffers = {}
+
+    def get_slot_buffer(slot, key, shape, dtype):
+        """array of the prefetch slot, reused across the blocks of the same shape; a new one without slot"""
+        if slot is None:
+            return numpy.empty(shape, dtype=dtype)
+        buffer = slot_buffers.get((slot, key))
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = slot_buffers[(slot, key)] = numpy.empty(shape, dtype=dtype)
+        return buffer
+
+    # seconds spent reading by the prefetch thread & waiting for it
+    myReadTime = 0.0
+    myWaitTime = 0.0
+
+    thread_buffers = threading.local()
+
+    def get_buffer(name, shape, dtype):
+        """scratch array of the current thread, reused across the blocks of the same shape"""
+        key = (name, shape, dtype)
+        if getattr(thread_buffers, "key_" + name, None) != key:
+            setattr(thread_buffers, name, numpy.empty(shape, dtype=dtype))
+            setattr(thread_buffers, "key_" + name, key)
+        return getattr(thread_buffers, name)
 
     # variables for displaying progress
     ProgressCt = -1
     ProgressMk = -1
-    ProgressEnd = nXBlocks * nYBlocks * allBandsCount
+    ProgressEnd = len(myWindows) * allBandsCount
+
+    def progress():
+        nonlocal ProgressCt, ProgressMk
+        ProgressCt += 1
+        if 10 * ProgressCt / ProgressEnd % 10 != ProgressMk and not quiet:
+            ProgressMk = 10 * ProgressCt / ProgressEnd % 10
+            print("%d.." % (10 * ProgressMk), end=" ")
+        # gdal style progress callback, returning 0 cancels
+        if callback and not callback(ProgressCt / ProgressEnd, "", callback_data):
+            raise RuntimeError("User terminated")
 
     ################################################################
     # start looping through each band in allBandsCount
@@ -494,14 +708,6 @@ def Calc(
 
     for bandNo in range(1, allBandsCount + 1):
 
-        ################################################################
-        # start looping through blocks of data
-        ################################################################
-
-        # store these numbers in variables that may change later
-        nXValid = myBlockSize[0]
-        nYValid = myBlockSize[1]
-
         count_file_per_alpha = {}
         largest_datatype_per_alpha = {}
         for i, Alpha in enumerate(myAlphaList):
@@ -522,134 +728,179 @@ def Calc(
                             largest_datatype_per_alpha[Alpha], band.DataType
                         )
 
-        # loop through X-lines
-        for X in range(0, nXBlocks):
-
-            # in case the blocks don't fit perfectly
-            # change the block size of the final piece
-            if X == nXBlocks - 1:
-                nXValid = DimensionsCheck[0] - X * myBlockSize[0]
-
-            # find X offset
-            myX = X * myBlockSize[0]
-
-            # reset buffer size for start of Y loop
-            nYValid = myBlockSize[1]
-            myBufSize = nXValid * nYValid
-
-            # loop through Y lines
-            for Y in range(0, nYBlocks):
-                ProgressCt += 1
-                if 10 * ProgressCt / ProgressEnd % 10 != ProgressMk and not quiet:
-                    ProgressMk = 10 * ProgressCt / ProgressEnd % 10
-                    print("%d.." % (10 * ProgressMk), end=" ")
-
-                # change the block size of the final piece
-                if Y == nYBlocks - 1:
-                    nYValid = DimensionsCheck[1] - Y * myBlockSize[1]
-                    myBufSize = nXValid * nYValid
-
-                # find Y offset
-                myY = Y * myBlockSize[1]
+        def read_block(myX, myY, nXValid, nYValid, slot=None):
+            """reads the window of every input, into the buffers of the prefetch slot if given (reused every other
+            block) else into new arrays; returns the stacked arrays per list alpha & the array per input"""
+            files = get_files()
+
+            # Create destination numpy arrays for each alpha
+            numpy_arrays = {}
+            counter_per_alpha = {}
+            for Alpha in count_file_per_alpha:
+                dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
+                    largest_datatype_per_alpha[Alpha]
+                )
+                if count_file_per_alpha[Alpha] == 1:
+                    shape = (nYValid, nXValid)
+                else:
+                    shape = (count_file_per_alpha[Alpha], nYValid, nXValid)
+                numpy_arrays[Alpha] = get_slot_buffer(slot, Alpha, shape, dtype)
+                counter_per_alpha[Alpha] = 0
 
-                # create empty buffer to mark where nodata occurs
-                myNDVs = None
+            # fetch data for each input layer
+            myvals = []
+            for i, Alpha in enumerate(myAlphaList):
 
-                # make local namespace for calculation
-                local_namespace = {}
+                # populate lettered arrays with values
+                if allBandsIndex is not None and allBandsIndex == i:
+                    myBandNo = bandNo
+                else:
+                    myBandNo = myBands[i]
+                myBand = files[i].GetRasterBand(myBandNo)
 
-                # Create destination numpy arrays for each alpha
-                numpy_arrays = {}
-                counter_per_alpha = {}
-                for Alpha in count_file_per_alpha:
-                    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(
-                        largest_datatype_per_alpha[Alpha]
-                    )
+                if Alpha in myAlphaFileLists:
                     if count_file_per_alpha[Alpha] == 1:
-                        numpy_arrays[Alpha] = numpy.empty(
-                            (nYValid, nXValid), dtype=dtype
-                        )
+                        buf_obj = numpy_arrays[Alpha]
                     else:
-                        numpy_arrays[Alpha] = numpy.empty(
-                            (count_file_per_alpha[Alpha], nYValid, nXValid), dtype=dtype
-                        )
-                    counter_per_alpha[Alpha] = 0
+                        buf_obj = numpy_arrays[Alpha][counter_per_alpha[Alpha]]
+                    counter_per_alpha[Alpha] += 1
+                elif slot is not None:
+                    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(myBand.DataType)
+                    buf_obj = get_slot_buffer(slot, i, (nYValid, nXValid), dtype)
+                else:
+                    buf_obj = None
+                myval = gdal_array.BandReadAsArray(
+                    myBand,
+                    xoff=myX,
+                    yoff=myY,
+                    win_xsize=nXValid,
+                    win_ysize=nYValid,
+                    buf_obj=buf_obj,
+                )
+                if myval is None:
+                    raise Exception(
+                        f"Input block reading failed from filename {myFileNames[i]}"
+                    )
+                myvals.append(myval)
+            return numpy_arrays, myvals
+
+        def calc_read_block(nXValid, nYValid, numpy_arrays, myvals):
+            """returns the calculation result of the read block"""
+            # create empty buffer to mark where nodata occurs
+            myNDVs = None
+
+            # make local namespace for calculation
+            local_namespace = {}
+
+            for i, (Alpha, myval) in enumerate(zip(myAlphaList, myvals)):
+                # fill in nodata values
+                if myNDV[i] is not None:
+                    # myNDVs is a boolean buffer.
+                    # a cell is True if there is NDV in any of the corresponding cells in input raster bands.
+                    myIsNDV = get_buffer("is_ndv", (nYValid, nXValid), bool)
+                    if math.isnan(myNDV[i]):
+                        numpy.isnan(myval, out=myIsNDV)
+                    else:
+                        numpy.equal(myval, myNDV[i], out=myIsNDV)
+                    if myNDVs is None:
+                        # this is the first band that has NDV set
+                        myNDVs = get_buffer("ndvs", (nYValid, nXValid), bool)
+                        myNDVs[...] = myIsNDV
+                    else:
+                        myNDVs |= myIsNDV
 
-                # fetch data for each input layer
-                for i, Alpha in enumerate(myAlphaList):
+                # add an array of values for this block to the eval namespace
+                if Alpha not in myAlphaFileLists:
+                    local_namespace[Alpha] = myval
 
-                    # populate lettered arrays with values
-                    if allBandsIndex is not None and allBandsIndex == i:
-                        myBandNo = bandNo
-                    else:
-                        myBandNo = myBands[i]
+            for lst in myAlphaFileLists:
+                local_namespace[lst] = numpy_arrays[lst]
 
-                    if Alpha in myAlphaFileLists:
-                        if count_file_per_alpha[Alpha] == 1:
-                            buf_obj = numpy_arrays[Alpha]
-                        else:
-                            buf_obj = numpy_arrays[Alpha][counter_per_alpha[Alpha]]
-                        myval = gdal_array.BandReadAsArray(
-                            myFiles[i].GetRasterBand(myBandNo),
-                            xoff=myX,
-                            yoff=myY,
-                            win_xsize=nXValid,
-                            win_ysize=nYValid,
-                            buf_obj=buf_obj,
-                        )
-                        counter_per_alpha[Alpha] += 1
-                    else:
-                        myval = gdal_array.BandReadAsArray(
-                            myFiles[i].GetRasterBand(myBandNo),
-                            xoff=myX,
-                            yoff=myY,
-                            win_xsize=nXValid,
-                            win_ysize=nYValid,
-                        )
-                    if myval is None:
-                        raise Exception(
-                            f"Input block reading failed from filename {filename[i]}"
-                        )
+            # try the calculation on the array blocks
+            this_calc = calc[bandNo - 1 if len(calc) > 1 else 0]
+            try:
+                myResult = eval(myCodes[bandNo - 1 if len(calc) > 1 else 0], global_namespace, local_namespace)
+            except Exception:
+                print(f"evaluation of calculation {this_calc} failed")
+                raise
+
+            if not isinstance(myResult, numpy.ndarray) or myResult.shape != (nYValid, nXValid):
+                # a full array, not a read-only zero strides broadcast view that BandWriteArray can't write
+                myResult = numpy.full((nYValid, nXValid), myResult)
+            # Propagate nodata values (set the output nodata value on the nodata cells)
+            if myNDVs is not None and myOutNDV is not None and myNDVs.any():
+                if not myResult.flags.writeable or not holds(myResult.dtype, myOutNDV):
+                    myResult = myResult.astype(numpy.result_type(myResult.dtype, numpy.float64))
+                numpy.putmask(myResult, myNDVs, myOutNDV)
+            return myResult
+
+        def calc_block(myX, myY, nXValid, nYValid):
+            """reads the window of every input and returns the calculation result"""
+            return calc_read_block(nXValid, nYValid, *read_block(myX, myY, nXValid, nYValid))
+
+        def timed_read_block(window, slot):
+            myStart = time.perf_counter()
+            return read_block(*window, slot=slot), time.perf_counter() - myStart
+
+        def write_block(myResult, myX, myY):
+            # write data block to the output file
+            myOutB = myOut.GetRasterBand(bandNo)
+            if gdal_array.BandWriteArray(myOutB, myResult, xoff=myX, yoff=myY) != 0:
+                raise Exception("Block writing failed")
+            myOutB = None  # write to band
 
-                    # fill in nodata values
-                    if myNDV[i] is not None:
-                        # myNDVs is a boolean buffer.
-                        # a cell equals to 1 if there is NDV in any of the corresponding cells in input raster bands.
-                        if myNDVs is None:
-                            # this is the first band that has NDV set. we initializes myNDVs to a zero buffer
-                            # as we didn't see any NDV value yet.
-                            myNDVs = numpy.zeros(myBufSize)
-                            myNDVs.shape = (nYValid, nXValid)
-                        myNDVs = 1 * numpy.logical_or(myNDVs == 1, myval == myNDV[i])
-
-                    # add an array of values for this block to the eval namespace
-                    if Alpha not in myAlphaFileLists:
-                        local_namespace[Alpha] = myval
-                    myval = None
-
-                for lst in myAlphaFileLists:
-                    local_namespace[lst] = numpy_arrays[lst]
-
-                # try the calculation on the array blocks
-                this_calc = calc[bandNo - 1 if len(calc) > 1 else 0]
+        ################################################################
+        # start looping through blocks of data
+        ################################################################
+
+        if threads == 1 and not prefetch:
+            for myX, myY, nXValid, nYValid in myWindows:
+                progress()
+                write_block(calc_block(myX, myY, nXValid, nYValid), myX, myY)
+        elif threads == 1:
+            # double buffered read-ahead: a reader thread fills one slot with the next window while this thread
+            # calculates & writes the other; the datasets are only ever read by the reader thread
+            with ThreadPoolExecutor(max_workers=1) as reader:
+                future = reader.submit(timed_read_block, myWindows[0], 0)
                 try:
-                    myResult = eval(this_calc, global_namespace, local_namespace)
-                except Exception:
-                    print(f"evaluation of calculation {this_calc} failed")
+                    for k, (myX, myY, nXValid, nYValid) in enumerate(myWindows):
+                        myStart = time.perf_counter()
+                        myRead, myReadSeconds = future.result()
+                        myWaitTime += time.perf_counter() - myStart
+                        myReadTime += myReadSeconds
+                        if k + 1 < len(myWindows):
+                            future = reader.submit(timed_read_block, myWindows[k + 1], (k + 1) % 2)
+                        progress()
+                        write_block(calc_read_block(nXValid, nYValid, *myRead), myX, myY)
+                        myRead = None
+                except BaseException:
+                    future.cancel()
+                    raise
+        else:
+            # blocks are read & calculated concurrently, at most 2 per thread in flight to bound memory, and written
+            # by this thread in the same order they were submitted
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                in_flight = deque()
+                try:
+                    for window in myWindows:
+                        in_flight.append((executor.submit(calc_block, *window), window))
+                        if len(in_flight) >= 2 * threads:
+                            future, (myX, myY, _, _) = in_flight.popleft()
+                            progress()
+                            write_block(future.result(), myX, myY)
+                    while in_flight:
+                        future, (myX, myY, _, _) = in_flight.popleft()
+                        progress()
+                        write_block(future.result(), myX, myY)
+                except BaseException:
+                    for future, _ in in_flight:
+                        future.cancel()
                     raise
 
-                # Propagate nodata values (set nodata cells to zero
-                # then add nodata value to these cells).
-                if myNDVs is not None and myOutNDV is not None:
-                    myResult = ((1 * (myNDVs == 0)) * myResult) + (myOutNDV * myNDVs)
-                elif not isinstance(myResult, numpy.ndarray):
-                    myResult = numpy.ones((nYValid, nXValid)) * myResult
-
-                # write data block to the output file
-                myOutB = myOut.GetRasterBand(bandNo)
-                if gdal_array.BandWriteArray(myOutB, myResult, xoff=myX, yoff=myY) != 0:
-                    raise Exception("Block writing failed")
-                myOutB = None  # write to band
+    # close the worker threads datasets
+    for files in thread_files_opened:
+        files.clear()
+    thread_files_opened = None
 
     # remove temp files
     for idx, tempFile in enumerate(myTempFileNames):
@@ -664,6 +915,19 @@ def Calc(
     if not quiet:
         print("100 - Done")
 
+    # overlap achieved by the prefetch: reading time hidden behind the calculation
+    myMessage = ""
+    if threads == 1 and prefetch and myReadTime > 0:
+        myHidden = max(0.0, myReadTime - myWaitTime)
+        myMessage = (
+            f"prefetch: reading took {myReadTime:.2f}s, {myHidden:.2f}s ({myHidden / myReadTime:.0%}) of it "
+            f"overlapped the calculation, {myWaitTime:.2f}s waited for reads"
+        )
+        if not quiet or debug:
+            print(myMessage)
+    if callback:
+        callback(1.0, myMessage, callback_data)
+
     return myOut
 
 
@@ -856,6 +1120,30 @@ class GDALCalc(GDALScript):
             "--color-table", type=str, dest="color_table", help="color table file name"
         )
 
+        parser.add_argument(
+            "--threads",
+            dest="threads",
+            type=int,
+            default=1,
+            metavar="n",
+            help="number of threads reading and calculating blocks concurrently (0 for all cpus)",
+        )
+
+        parser.add_argument(
+            "--memory_budget",
+            dest="memory_budget",
+            type=str,
+            metavar="size",
+            help="memory for the blocks being calculated, such as 512MB or 2GB, sizes the windows",
+        )
+
+        parser.add_argument(
+            "--no_prefetch",
+            dest="prefetch",
+            action="store_false",
+            help="don't read the next block in the background while calculating (single thread only)",
+        )
+
         group = parser.add_mutually_exclusive_group()
         group.add_argument(
             "--extent",
@@ -8,7 +8,8 @@ usage: gdal_calc_norm.py [-h] [-i INFILE] [-o OUTFILE]
                          [-min MINIMUM] [-max MAXIMUM] [-n [NODATAVALUE]]  
                          [-f FORMAT]  
                          [-t {Byte,UInt16,Int16,UInt32,Int32,UInt64,Int64,Float32,Float64,CInt16,CInt32,CFloat32,CFloat64}]  
-                         [-p min_x max_y max_x min_y] [-r]  
+                         [-p min_x max_y max_x min_y] [-T THREADS]  
+                         [-M MEMORY_BUDGET] [-r]  
                          [params ...]  
 
 Raster normalization utility, wrapping on osgeo_utils.gdal_calc with a set of
@@ -52,6 +53,13 @@ options:
                         An optional list of 4 coordinates defining the
                         projection window, if not provided the whole raster is
                         calculated (default: None)
+  -T THREADS, --threads THREADS
+                        Number of threads computing blocks concurrently, 0
+                        for all cpus (default: 1)
+  -M MEMORY_BUDGET, --memory_budget MEMORY_BUDGET
+                        Memory for the blocks being calculated, such as 512MB
+                        or 2GB, sizes the windows (default: from the inputs
+                        block sizes)
   -r, --return_dataset  Return dataset (for scripting -additional keyword
                         arguments are passed to gdal_calc.Calc) instead of
                         return code (default: False)
@@ -90,11 +98,13 @@ function osgeo_utils.gdal_calc.Calc(
 # fmt: on
 import sys
 from pathlib import Path
-from tempfile import NamedTemporaryFile
 
 from osgeo.gdal import Dataset, GA_ReadOnly, Open
 from osgeo_utils.auxiliary.util import GetOutputDriverFor
-from gdal_calc import Calc, GDALDataTypeNames
+from gdal_calc import Calc, GDALDataTypeNames, parse_memory
+from stats_cache import get_raster_stats
+# shared with pan_batido, re-exported for gdal_calc_normsum
+from normalization import MINMAX_METHODS, NAMESPACE, expression  # noqa: F401
 
 
 def calc(
@@ -125,7 +135,7 @@ def calc(
     if isinstance(outfile, Path):
         outfile = str(outfile)
     if "method" in kwargs:
-        if kwargs["method"] in ["minmax", "maxmin", "bipiecewiselinear_percent", "stepup_percent", "stepdown_percent"]:
+        if kwargs["method"] in MINMAX_METHODS:
             if minimum is None and maximum is None:
                 minimum, maximum = get_file_minmax(infile)
                 print(f"{minimum=}, {maximum=}")
@@ -154,6 +164,8 @@ def calc(
     print(f"{local_var_names=}")
     print(f"{func_vars=}")
 
+    kwargs["user_namespace"] = {**NAMESPACE, **(kwargs.get("user_namespace") or {})}
+
     dataset = Calc(
         calc=func(*func_vars),
         outfile=outfile,
@@ -256,6 +268,19 @@ def arg_parser(argv=None):
         metavar=("min_x", "max_y", "max_x", "min_y"),
         help="An optional list of 4 coordinates defining the projection window, if not provided the whole raster is calculated",
     )
+    parser.add_argument(
+        "-T",
+        "--threads",
+        help="Number of threads computing blocks concurrently, 0 for all cpus",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-M",
+        "--memory_budget",
+        help="Memory for the blocks being calculated, such as 512MB or 2GB, sizes the windows (default: from the inputs block sizes)",
+        type=parse_memory,
+    )
     parser.add_argument(
         "-r",
         "--return_dataset",
@@ -271,15 +296,15 @@ def arg_parser(argv=None):
     return args
 
 
-def main(argv=None):
+def main(argv=None, **kwargs):
     """
     <pre><code>
     minmax: (A-minimum)/(maximum - minimum)
     maxmin: (A-maximum)/(minimum - maximum)
     stepup: 0*(A<threshold)+1*(A>=threshold)
     stepdown: 1*(A<threshold)+0*(A>=threshold)
-    bipiecewiselinear: (A-a)/(b-a) then "0*(A<0)+1*(A>1)"
-    bipiecewiselinear_percent: (A-a*r)/(b*r-a*r) then "0*(A<0)+1*(A>1)"
+    bipiecewiselinear: (A-a)/(b-a) clamped to [0, 1] in the same pass
+    bipiecewiselinear_percent: (A-a*r)/(b*r-a*r) clamped to [0, 1] in the same pass
     stepup_percent: 0*(A<threshold*r)+1*(A>=threshold*r)
     stepdown_percent: 1*(A<threshold*r)+0*(A>=threshold*r)
 
@@ -295,39 +320,27 @@ def main(argv=None):
     if args.method == "minmax":
         del args.params
         func = lambda minimum, maximum: f"(A-{minimum})/({maximum} - {minimum})"
-        ds = calc(func, **vars(args))
+        ds = calc(func, **vars(args), **kwargs)
     elif args.method == "maxmin":
         del args.params
         func = lambda minimum, maximum: f"(A-{maximum})/({minimum} - {maximum})"
-        ds = calc(func, **vars(args))
+        ds = calc(func, **vars(args), **kwargs)
     elif args.method == "stepup":
         threshold = args.params[0]
         del args.params
         func = lambda threshold: f"0*(A<{threshold})+1*(A>={threshold})"
-        ds = calc(func, **vars(args), threshold=threshold)
+        ds = calc(func, **vars(args), **kwargs, threshold=threshold)
     elif args.method == "stepdown":
         threshold = args.params[0]
         del args.params
         func = lambda threshold: f"1*(A<{threshold})+0*(A>={threshold})"
-        ds = calc(func, **vars(args), threshold=threshold)
+        ds = calc(func, **vars(args), **kwargs, threshold=threshold)
     elif args.method == "bipiecewiselinear":
         a = args.params[0]
         b = args.params[1]
         del args.params
-
-        keep = args.outfile
-        args.outfile = Path(NamedTemporaryFile(suffix=".tif", delete=False).name)
-        print(f"{args=}")
-
-        func = lambda a, b: f"(A-{a})/({b}-{a})"
-        ds = calc(func, **vars(args), a=a, b=b)
-
-        args.infile = args.outfile
-        args.outfile = keep
-        print(f"{args=}")
-
-        func = lambda: "0*(A<0)+1*(A>1)+A*((0<=A)&(A<=1))"
-        ds = calc(func, **vars(args))
+        func = lambda a, b: f"clip01((A-{a})/({b}-{a}))"
+        ds = calc(func, **vars(args), **kwargs, a=a, b=b)
     elif args.method == "bipiecewiselinear_percent":
         """
         rela_delta = data.max() - data.min() / 100
@@ -338,30 +351,18 @@ def main(argv=None):
         a = args.params[0]
         b = args.params[1]
         del args.params
-
-        keep = args.outfile
-        args.outfile = Path(NamedTemporaryFile(suffix=".tif", delete=False).name)
-        print(f"{args=}")
-
-        func = lambda a, b, r: f"(A-{a*r})/({b*r}-{a*r})"
-        ds = calc(func, **vars(args), a=a, b=b, r=0)
-
-        args.infile = args.outfile
-        args.outfile = keep
-        print(f"{args=}")
-
-        func = lambda: "0*(A<0)+1*(A>1)+A*((0<=A)&(A<=1))"
-        ds = calc(func, **vars(args))
+        func = lambda a, b, r: f"clip01((A-{a*r})/({b*r}-{a*r}))"
+        ds = calc(func, **vars(args), **kwargs, a=a, b=b, r=0)
     elif args.method == "stepup_percent":
         threshold = args.params[0]
         del args.params
         func = lambda threshold, r: f"0*(A<{threshold*r})+1*(A>={threshold*r})"
-        ds = calc(func, **vars(args), threshold=threshold, r=0)
+        ds = calc(func, **vars(args), **kwargs, threshold=threshold, r=0)
     elif args.method == "stepdown_percent":
         threshold = args.params[0]
         del args.params
         func = lambda threshold, r: f"1*(A<{threshold*r})+0*(A>={threshold*r})"
-        ds = calc(func, **vars(args), threshold=threshold, r=0)
+        ds = calc(func, **vars(args), **kwargs, threshold=threshold, r=0)
     """
     elif args.method == "":
         del args.method
@@ -377,20 +378,17 @@ def main(argv=None):
     return 1
 
 
-def get_file_minmax(filename, force=True):
-    # try:
+def get_file_minmax(filename, force=False):
+    """Band 1 minimum & maximum, from the persistent statistics cache (force rescans the raster)"""
+    stats = get_raster_stats(filename, force=force)
+    return stats["min"], stats["max"]
+
+
+def get_file_nodata(filename, band=1):
     dataset = Open(filename, GA_ReadOnly)
-    # except RuntimeError as e:
-    #     if "not recognized as a supported file format" in str(e):
-    #         raise FileNotFoundError("not recognized as a supported file format " + filename)
     if dataset is None:
         raise FileNotFoundError(filename)
-    raster_band = dataset.GetRasterBand(1)
-    rmin = raster_band.GetMinimum()
-    rmax = raster_band.GetMaximum()
-    if not rmin or not rmax or force:
-        (rmin, rmax) = raster_band.ComputeRasterMinMax(True)
-    return rmin, rmax
+    return dataset.GetRasterBand(band).GetNoDataValue()
 
 
 if __name__ == "__main__":
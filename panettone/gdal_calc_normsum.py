@@ -0,0 +1,309 @@
+#!python
+"""
+<pre><code>
+<!-- BEGIN_ARGPARSE_DOCSTRING -->
+usage: gdal_calc_normsum.py [-h] [-o OUTFILE] -m METHODS [METHODS ...] [-P [PARAMS ...]] [-w [WEIGHTS ...]]
+                            [-min [MINIMUMS ...]] [-max [MAXIMUMS ...]] [-f FORMAT]
+                            [-t {Byte,UInt16,Int16,UInt32,Int32,UInt64,Int64,Float32,Float64,CInt16,CInt32,CFloat32,CFloat64}]
+                            [-p min_x max_y max_x min_y] [-n [value]] [-T THREADS] [-M MEMORY_BUDGET] [-r]
+                            infiles [infiles ...]
+
+Single pass normalization and weighted summation of rasters, wrapping osgeo_utils.gdal_calc for
+sum(weights*normalize(rasters)). Each input block is read once and no intermediate normalized raster is written. Run
+`gdal_calc.py --help` for more information.
+
+positional arguments:
+  infiles               List of rasters to normalize and sum
+
+options:
+  -h, --help            show this help message and exit
+  -o OUTFILE, --outfile OUTFILE
+                        Output file (default: outfile.tif)
+  -m METHODS [METHODS ...], --methods METHODS [METHODS ...]
+                        Normalization method of each input raster (default: None)
+  -P [PARAMS ...], --params [PARAMS ...]
+                        Comma separated normalization params of each input raster, 'none' for methods without params,
+                        e.g.: none 50 10,90 (default: None)
+  -w [WEIGHTS ...], --weights [WEIGHTS ...]
+                        An optional list of weights to ponder the summation (else 1's) (default: None)
+  -min [MINIMUMS ...], --minimums [MINIMUMS ...]
+                        Minimum value of each input raster, 'none' to calculate it from the WHOLE input raster
+                        (default: None)
+  -max [MAXIMUMS ...], --maximums [MAXIMUMS ...]
+                        Maximum value of each input raster, 'none' to calculate it from the WHOLE input raster
+                        (default: None)
+  -f FORMAT, --format FORMAT
+                        Output format (default: GTiff)
+  -t {Byte,UInt16,Int16,UInt32,Int32,UInt64,Int64,Float32,Float64,CInt16,CInt32,CFloat32,CFloat64}, --type {Byte,UInt16,Int16,UInt32,Int32,UInt64,Int64,Float32,Float64,CInt16,CInt32,CFloat32,CFloat64}
+                        Output datatype (default: Float32)
+  -p min_x max_y max_x min_y, --projwin min_x max_y max_x min_y
+                        An optional list of 4 coordinates defining the projection window, if not provided the 1st
+                        raster projwin is used (default: None)
+  -n [value], --NoDataValue [value]
+                        Output NoDataValue (Defaults to 'none' to be weight summed) (default: none)
+  -T THREADS, --threads THREADS
+                        Number of threads computing blocks concurrently, 0 for all cpus (default: 1)
+  -M MEMORY_BUDGET, --memory_budget MEMORY_BUDGET
+                        Memory for the blocks being calculated, such as 512MB or 2GB, sizes the windows (default: from the
+                        inputs block sizes)
+  -r, --return_dataset  Return dataset (for scripting -additional keyword arguments are passed to gdal_calc.Calc)
+                        instead of return code (default: False)
+
+documentation at https://fire2a.github.io/fire2a-lib/fire2a/raster/gdal_calc_normsum.html
+<!-- END_ARGPARSE_DOCSTRING -->
+
+Input NoDataValues are summed as 0, same as normalizing with gdal_calc_norm (NoDataValue=0) then summing with
+gdal_calc_sum --hideNoDataValue
+
+Sample script usage:
+    from gdal_calc_normsum import main
+    ds = main(["-r", ... other keyword arguments are passed to gdal_calc.Calc
+</code></pre>
+"""
+import sys
+from math import isnan
+from pathlib import Path
+
+from constants import METHODS
+from gdal_calc import Calc, GDALDataTypeNames, parse_memory
+from gdal_calc_norm import MINMAX_METHODS, NAMESPACE, expression, get_file_minmax, get_file_nodata
+from osgeo.gdal import Dataset
+from osgeo_utils.auxiliary.util import GetOutputDriverFor
+
+
+def calc(
+    outfile="outfile.tif",
+    infiles=["infile.tif", "infile2.tif"],
+    methods=["minmax", "minmax"],
+    params=None,
+    weights=None,
+    minimums=None,
+    maximums=None,
+    NoDataValue="none",
+    overwrite=True,
+    type="Float32",
+    format="GTiff",
+    projwin=None,
+    **kwargs,
+) -> Dataset:
+    """This is the wrapper function for the gdal_calc.Calc utility.
+
+    Creates the string symbolizing a weighted sum of normalized rasters, so all the inputs are read, normalized, pondered
+    and summed block by block in a single gdal_calc.Calc pass.
+
+    :param methods: normalization method name of each raster (see gdal_calc_norm.expression)
+    :param params: list of float lists, the normalization params of each raster
+    :param minimums: list of raster minimums (None items are calculated from the whole raster)
+    :param maximums: list of raster maximums (None items are calculated from the whole raster)
+
+    All extra keyword arguments are passed to the gdal_calc.Calc function."""
+    infiles = [str(infile) for infile in infiles]
+    if isinstance(outfile, Path):
+        outfile = str(outfile)
+    params = params or [[] for _ in infiles]
+    weights = weights or [1 for _ in infiles]
+    minimums = minimums or [None for _ in infiles]
+    maximums = maximums or [None for _ in infiles]
+
+    # all inputs are read as one 3-D block stack, so their number is only bounded by the memory per block (a single
+    # input is read as a 2-D block)
+    letter_file = {"a": infiles}
+    letter_calc = []
+
+    AlphaList = [f"a[{i}]" for i in range(len(infiles))] if len(infiles) > 1 else ["a"]
+    for alpha, afile, method, param, weight, minimum, maximum in zip(
+        AlphaList, infiles, methods, params, weights, minimums, maximums
+    ):
+        if method in MINMAX_METHODS and (minimum is None or maximum is None):
+            file_min, file_max = get_file_minmax(afile)
+            minimum = file_min if minimum is None else minimum
+            maximum = file_max if maximum is None else maximum
+        norm = expression(method, param, minimum, maximum, alpha=alpha)
+        # nodata pixels add 0 to the summation
+        nodata = get_file_nodata(afile)
+        if nodata is not None:
+            mask = f"isnan({alpha})" if isnan(nodata) else f"({alpha}=={nodata})"
+            norm = f"where({mask}, 0, {norm})"
+        letter_calc += [f"{weight}*({norm})"]
+        print(f"{alpha}={afile} {method=} {param=} {minimum=} {maximum=} {nodata=}")
+
+    letter_calc = "+".join(letter_calc)
+    print(f"{letter_calc=}")
+
+    # input nodata is already handled by the expression
+    kwargs["hideNoData"] = True
+    kwargs["user_namespace"] = {**NAMESPACE, **(kwargs.get("user_namespace") or {})}
+
+    dataset = Calc(
+        calc=letter_calc,
+        outfile=outfile,
+        NoDataValue=NoDataValue,
+        overwrite=overwrite,
+        type=type,
+        format=format,
+        projwin=projwin,
+        **kwargs,
+        **letter_file,
+    )
+    dataset.FlushCache()
+
+    return dataset
+
+
+def arg_parser(argv=None):
+    """Parse arguments list"""
+    from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, ArgumentTypeError
+    from typing import Union
+
+    def float_or_none(value: str) -> Union[float, str]:
+        if value.lower() == "none":
+            return value
+
+        try:
+            return float(value)
+        except ValueError:
+            msg = f"wtf Invalid float value: {value}"
+            raise ArgumentTypeError(msg)
+
+    def params_list(value: str) -> list:
+        if value.lower() == "none":
+            return []
+        try:
+            return [float(v) for v in value.split(",")]
+        except ValueError:
+            msg = f"Invalid comma separated float values: {value}"
+            raise ArgumentTypeError(msg)
+
+    parser = ArgumentParser(
+        description="Single pass normalization and weighted summation of rasters, wrapping osgeo_utils.gdal_calc for sum(weights*normalize(rasters)). Each input block is read once and no intermediate normalized raster is written. Run `gdal_calc.py --help` for more information.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        epilog="documentation at https://fire2a.github.io/fire2a-lib/fire2a/raster/gdal_calc_normsum.html",
+    )
+    parser.add_argument(
+        "infiles",
+        nargs="+",
+        type=Path,
+        help="List of rasters to normalize and sum",
+    )
+    parser.add_argument("-o", "--outfile", help="Output file", type=Path, default="outfile.tif")
+    parser.add_argument(
+        "-m",
+        "--methods",
+        nargs="+",
+        type=str,
+        choices=METHODS,
+        required=True,
+        help="Normalization method of each input raster",
+    )
+    parser.add_argument(
+        "-P",
+        "--params",
+        nargs="*",
+        type=params_list,
+        help="Comma separated normalization params of each input raster, 'none' for methods without params, e.g.: none 50 10,90",
+    )
+    parser.add_argument(
+        "-w",
+        "--weights",
+        nargs="*",
+        type=float,
+        help="An optional list of weights to ponder the summation (else 1's)",
+    )
+    parser.add_argument(
+        "-min",
+        "--minimums",
+        nargs="*",
+        type=float_or_none,
+        help="Minimum value of each input raster, 'none' to calculate it from the WHOLE input raster",
+    )
+    parser.add_argument(
+        "-max",
+        "--maximums",
+        nargs="*",
+        type=float_or_none,
+        help="Maximum value of each input raster, 'none' to calculate it from the WHOLE input raster",
+    )
+    parser.add_argument("-f", "--format", help="Output format", type=str, default="GTiff")
+    parser.add_argument(
+        "-t", "--type", help="Output datatype", type=str, default="Float32", choices=list(map(str, GDALDataTypeNames))
+    )
+    parser.add_argument(
+        "-p",
+        "--projwin",
+        nargs=4,
+        type=float,
+        metavar=("min_x", "max_y", "max_x", "min_y"),
+        help="An optional list of 4 coordinates defining the projection window, if not provided the 1st raster projwin is used",
+    )
+    parser.add_argument(
+        "-n",
+        "--NoDataValue",
+        help="Output NoDataValue (Defaults to 'none' to be weight summed)",
+        type=float_or_none,
+        metavar="value",
+        nargs="?",
+        default="none",
+    )
+    parser.add_argument(
+        "-T",
+        "--threads",
+        help="Number of threads computing blocks concurrently, 0 for all cpus",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-M",
+        "--memory_budget",
+        help="Memory for the blocks being calculated, such as 512MB or 2GB, sizes the windows (default: from the inputs block sizes)",
+        type=parse_memory,
+    )
+    parser.add_argument(
+        "-r",
+        "--return_dataset",
+        help="Return dataset (for scripting -additional keyword arguments are passed to gdal_calc.Calc) instead of return code",
+        action="store_true",
+    )
+    args = parser.parse_args(argv)
+    args.projwin = tuple(args.projwin) if args.projwin else None
+    for infile in args.infiles:
+        if not infile.exists():
+            parser.error(f"Input raster {infile} does not exist")
+    for name in ["methods", "params", "weights", "minimums", "maximums"]:
+        values = getattr(args, name)
+        if values and len(values) != len(args.infiles):
+            parser.error(f"Number of {name} must match the number of input rasters")
+    for name in ["minimums", "maximums"]:
+        if values := getattr(args, name):
+            setattr(args, name, [None if isinstance(v, str) else v for v in values])
+    if args.format is None:
+        args.format = GetOutputDriverFor(args.outfile)
+    return args
+
+
+def main(argv=None, **kwargs):
+    """
+    <pre><code>
+    All arguments passed as:
+    ds = calc(**vars(args))
+    </code></pre>
+    """
+    if argv is sys.argv:
+        argv = sys.argv[1:]
+    args = arg_parser(argv)
+
+    print(f"{args=}")
+
+    return_dataset = args.return_dataset
+    del args.return_dataset
+    ds = calc(**vars(args), **kwargs)
+
+    if return_dataset:
+        return ds
+
+    if isinstance(ds, Dataset):
+        return 0
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -4,14 +4,14 @@
 <!-- BEGIN_ARGPARSE_DOCSTRING -->
 usage: gdal_calc_sum.py [-h] [-o OUTFILE] [-w [WEIGHTS ...]] [-f FORMAT]
                         [-t {Byte,UInt16,Int16,UInt32,Int32,UInt64,Int64,Float32,Float64,CInt16,CInt32,CFloat32,CFloat64}]
-                        [-p min_x max_y max_x min_y] [-n [NODATAVALUE]] [-r]
+                        [-p min_x max_y max_x min_y] [-n [NODATAVALUE]] [-T THREADS] [-M MEMORY_BUDGET] [-r]
                         infiles [infiles ...]
 
 Raster(s) (weighted) summation utility, wrapping osgeo_utils.gdal_calc for sum(weights*rasters). Run `gdal_calc.py --help` for more
 information.
 
 positional arguments:
-  infiles               List of rasters to sum up to 52
+  infiles               List of rasters to sum
 
 options:
   -h, --help            show this help message and exit
@@ -29,6 +29,11 @@ options:
   -n [NODATAVALUE], --NoDataValue [NODATAVALUE]
                         output nodata value (send empty for default datatype specific, see `from osgeo_utils.gdal_calc import
                         DefaultNDVLookup`) (default: -9999)
+  -T THREADS, --threads THREADS
+                        Number of threads computing blocks concurrently, 0 for all cpus (default: 1)
+  -M MEMORY_BUDGET, --memory_budget MEMORY_BUDGET
+                        Memory for the blocks being calculated, such as 512MB or 2GB, sizes the windows (default: from the
+                        inputs block sizes)
   -r, --return_dataset  Return dataset (for scripting -additional keyword arguments are passed to gdal_calc.Calc) instead of return
                         code (default: False)
 
@@ -62,13 +67,38 @@ function osgeo_utils.gdal_calc.Calc(
 /usr/lib/python3/dist-packages/osgeo_utils/gdal_calc.py
 </code></pre>
 """
-import string
 import sys
+import threading
 from pathlib import Path
 
+import numpy
 from osgeo.gdal import Dataset
 from osgeo_utils.auxiliary.util import GetOutputDriverFor
-from gdal_calc import Calc, GDALDataTypeNames
+from gdal_calc import Calc, GDALDataTypeNames, parse_memory
+
+scratch = threading.local()
+
+
+def weighted_sum(weights, *arrays):
+    """weights[0]*arrays[0] + weights[1]*arrays[1] + ... accumulated in place into one output array, with a single
+    scratch array reused by each thread, so the memory per block doesn't grow with the number of inputs.
+
+    Replaces the "w1*A+w2*B+..." expression, that allocates a temporary array for every product and every addition.
+    A single 3-D array is a stack of inputs (gdal_calc.Calc list of files alpha)"""
+    if len(arrays) == 1 and arrays[0].ndim == 3:
+        arrays = arrays[0]
+    dtype = numpy.result_type(*(array.dtype for array in arrays), numpy.float32)
+    out = numpy.multiply(arrays[0], weights[0], dtype=dtype)
+    if getattr(scratch, "array", None) is None or scratch.array.shape != out.shape or scratch.array.dtype != dtype:
+        scratch.array = numpy.empty_like(out)
+    for weight, array in zip(weights[1:], arrays[1:]):
+        numpy.multiply(array, weight, out=scratch.array)
+        out += scratch.array
+    return out
+
+
+# functions available to the summation expression, passed as gdal_calc.Calc user_namespace
+NAMESPACE = {"weighted_sum": weighted_sum}
 
 
 def calc(
@@ -84,7 +114,7 @@ def calc(
 ) -> Dataset:
     """This is the wrapper function for the gdal_calc.Calc utility.
 
-    Creates the string symbolizing a weighted sum of rasters.
+    Creates the string symbolizing a weighted sum of rasters, computed by the weighted_sum kernel.
 
     All extra keyword arguments are passed to the gdal_calc.Calc function."""
     for i, infile in enumerate(infiles):
@@ -97,20 +127,12 @@ def calc(
     #     projwin, _ = get_projwin(info["Transform"], info["RasterXSize"], info["RasterYSize"])
     #     print(f"{projwin=}")
 
-    letter_file = {}
-    letter_calc = ""
+    # all inputs are read as one 3-D block stack, so their number is only bounded by the memory per block
+    letter_file = {"a": infiles}
+    letter_calc = "weighted_sum(weights, a)"
 
-    AlphaList = list(string.ascii_letters)
-    if not weights:
-        for alpha, afile in zip(AlphaList, infiles):
-            letter_file[alpha] = afile
-            letter_calc += alpha + "+"
-    else:
-        for alpha, afile, weight in zip(AlphaList, infiles, weights):
-            letter_file[alpha] = afile
-            letter_calc += str(weight) + "*" + alpha + "+"
-
-    letter_calc = letter_calc[:-1]
+    weights = weights or [1 for _ in infiles]
+    kwargs["user_namespace"] = {**NAMESPACE, **(kwargs.get("user_namespace") or {}), "weights": weights}
 
     dataset = Calc(
         calc=letter_calc,
@@ -152,7 +174,7 @@ def arg_parser(argv=None):
         "infiles",
         nargs="+",
         type=Path,
-        help="List of rasters to sum up to 52",
+        help="List of rasters to sum",
     )
     parser.add_argument("-o", "--outfile", help="Output file", type=Path, default="outfile.tif")
     parser.add_argument(
@@ -183,6 +205,19 @@ def arg_parser(argv=None):
         nargs="?",
         default="none",
     )
+    parser.add_argument(
+        "-T",
+        "--threads",
+        help="Number of threads computing blocks concurrently, 0 for all cpus",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-M",
+        "--memory_budget",
+        help="Memory for the blocks being calculated, such as 512MB or 2GB, sizes the windows (default: from the inputs block sizes)",
+        type=parse_memory,
+    )
     parser.add_argument(
         "-r",
         "--return_dataset",
@@ -197,8 +232,6 @@ def arg_parser(argv=None):
     )
     args = parser.parse_args(argv)
     args.projwin = tuple(args.projwin) if args.projwin else None
-    if len(args.infiles) > 52:
-        parser.error("Number of input rasters must be less than 53")
     for infile in args.infiles:
         if not infile.exists():
             parser.error(f"Input raster {infile} does not exist")
@@ -210,7 +243,7 @@ def arg_parser(argv=None):
     return args
 
 
-def main(argv=None):
+def main(argv=None, **kwargs):
     """
     <pre><code>
     All arguments passed as:
@@ -223,7 +256,7 @@ def main(argv=None):
 
     print(f"{args=}")
 
-    ds = calc(**vars(args))
+    ds = calc(**vars(args), **kwargs)
 
     if args.return_dataset:
         return ds
@@ -34,7 +34,6 @@ from re import sub
 from shutil import which
 
 from osgeo_utils.gdal_calc import GDALDataTypeNames
-from processing.algs.gdal.GdalAlgorithm import GdalAlgorithm
 from processing.algs.gdal.GdalUtils import GdalUtils
 from qgis.core import (QgsProcessingException, QgsProcessingParameterDefinition, QgsProcessingParameterEnum,
                        QgsProcessingParameterExtent, QgsProcessingParameterNumber,
@@ -43,10 +42,11 @@ from qgis.core import (QgsProcessingException, QgsProcessingParameterDefinition,
 from qgis.PyQt.QtCore import QCoreApplication
 
 from .constants import METHODS
+from .panettone_in_process import InProcessGdalAlgorithm
 
 python = "python" if which("python") else "python3"
 
-class ProcessingGdalCalcNormAlgorithm(GdalAlgorithm):
+class ProcessingGdalCalcNormAlgorithm(InProcessGdalAlgorithm):
     INPUT_A = "INPUT_A"
     # BAND_A = "BAND_A"
     METHOD = "METHOD"
@@ -170,6 +170,9 @@ class ProcessingGdalCalcNormAlgorithm(GdalAlgorithm):
         max_param.setFlags(max_param.flags() | QgsProcessingParameterDefinition.Flag.FlagAdvanced)
         self.addParameter(max_param)
 
+        self.addCalcParameters()
+        self.addInProcessParameter()
+
         self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr("Calculated")))
 
     def name(self):
@@ -202,6 +205,12 @@ class ProcessingGdalCalcNormAlgorithm(GdalAlgorithm):
         # return "python " + str(Path(__file__).parent / "gdal_calc_norm.py")
         return "gdal_calc_norm"
 
+    def scriptMain(self):
+        # absolute import, same module the scripts import each other with
+        from gdal_calc_norm import main
+
+        return main
+
     def getConsoleCommands(self, parameters, context, feedback, executing=True):
 
         out = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
@@ -272,6 +281,8 @@ class ProcessingGdalCalcNormAlgorithm(GdalAlgorithm):
         if not bbox.isNull():
             arguments.append(f"--projwin {bbox.xMinimum()} {bbox.yMaximum()} {bbox.xMaximum()} {bbox.yMinimum()}")
 
+        arguments += self.calcArguments(parameters, context)
+
         arguments.append("--outfile")
         arguments.append('"' + out + '"')
 
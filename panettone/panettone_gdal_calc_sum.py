@@ -35,16 +35,17 @@ from re import sub
 from shutil import which
 
 from osgeo_utils.gdal_calc import GDALDataTypeNames
-from processing.algs.gdal.GdalAlgorithm import GdalAlgorithm
 from processing.algs.gdal.GdalUtils import GdalUtils
 from qgis.core import (QgsProcessing, QgsProcessingException, QgsProcessingParameterBoolean, QgsProcessingParameterEnum,
                        QgsProcessingParameterExtent, QgsProcessingParameterMultipleLayers, QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterDestination, QgsProcessingParameterString)
 from qgis.PyQt.QtCore import QCoreApplication
 
+from .panettone_in_process import InProcessGdalAlgorithm
+
 python = "python" if which("python") else "python3"
 
-class ProcessingGdalCalcSumAlgorithm(GdalAlgorithm):
+class ProcessingGdalCalcSumAlgorithm(InProcessGdalAlgorithm):
     INPUT = "INPUT"
     WEIGHTS = "WEIGHTS"
     EXTENT_OPT = "EXTENT_OPT"
@@ -143,6 +144,9 @@ class ProcessingGdalCalcSumAlgorithm(GdalAlgorithm):
         # extra_param.setFlags(extra_param.flags() | QgsProcessingParameterDefinition.Flag.FlagAdvanced)
         # self.addParameter(extra_param)
 
+        self.addCalcParameters()
+        self.addInProcessParameter()
+
         self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr("Calculated")))
 
     def name(self):
@@ -175,6 +179,12 @@ class ProcessingGdalCalcSumAlgorithm(GdalAlgorithm):
         # return "python " + str(Path(__file__).parent / "gdal_calc_sum.py")
         return "gdal_calc_sum.py"
 
+    def scriptMain(self):
+        # absolute import, same module the scripts import each other with
+        from gdal_calc_sum import main
+
+        return main
+
     def getConsoleCommands(self, parameters, context, feedback, executing=True):
 
         out = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
@@ -262,6 +272,8 @@ class ProcessingGdalCalcSumAlgorithm(GdalAlgorithm):
             if not bbox.isNull():
                 arguments.append(f"--projwin {bbox.xMinimum()} {bbox.yMaximum()} {bbox.xMaximum()} {bbox.yMinimum()}")
 
+        arguments += self.calcArguments(parameters, context)
+
         arguments.append("--outfile")
         arguments.append('"' + out + '"')
 
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ProcessingModuleNameAlgorithm
+                                 A QGIS plugin
+ This is the plugin description.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2025-02-18
+        copyright            : (C) 2025 by fdobad
+        email                : fbadilla@ing.uchile.cl
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = "fdobad"
+__date__ = "2025-02-18"
+__copyright__ = "(C) 2025 by fdobad"
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = "$Format:%H$"
+
+import shlex
+
+from processing.algs.gdal.GdalAlgorithm import GdalAlgorithm
+from qgis.core import (QgsProcessingException, QgsProcessingParameterBoolean, QgsProcessingParameterDefinition,
+                       QgsProcessingParameterNumber, QgsProcessingParameterString)
+
+
+class InProcessGdalAlgorithm(GdalAlgorithm):
+    """GdalAlgorithm that can also run the wrapped script `main` inside QGIS, on the processing task worker thread,
+    instead of spawning a python subprocess that re-imports numpy & osgeo on every run.
+
+    Subclasses implement scriptMain and call addInProcessParameter (and addCalcParameters) in initAlgorithm. The same
+    getConsoleCommands arguments are parsed by the script arg_parser, so both paths behave the same.
+    """
+
+    IN_PROCESS = "IN_PROCESS"
+    THREADS = "THREADS"
+    MEMORY_BUDGET = "MEMORY_BUDGET"
+
+    def scriptMain(self):
+        """Returns the main function of the wrapped script"""
+        raise NotImplementedError
+
+    def addInProcessParameter(self):
+        in_process_param = QgsProcessingParameterBoolean(
+            self.IN_PROCESS,
+            self.tr("Run inside QGIS (else a python subprocess is spawned)"),
+            defaultValue=True,
+            optional=True,
+        )
+        in_process_param.setFlags(in_process_param.flags() | QgsProcessingParameterDefinition.Flag.FlagAdvanced)
+        self.addParameter(in_process_param)
+
+    def addCalcParameters(self):
+        """Advanced gdal_calc.Calc block scheduling parameters"""
+        threads_param = QgsProcessingParameterNumber(
+            self.THREADS,
+            self.tr("Number of threads computing blocks concurrently (0 for all cpus)"),
+            type=QgsProcessingParameterNumber.Type.Integer,
+            defaultValue=1,
+            minValue=0,
+            optional=True,
+        )
+        threads_param.setFlags(threads_param.flags() | QgsProcessingParameterDefinition.Flag.FlagAdvanced)
+        self.addParameter(threads_param)
+        memory_param = QgsProcessingParameterString(
+            self.MEMORY_BUDGET,
+            self.tr("Memory budget for the blocks being calculated, such as 512MB or 2GB (empty for default)"),
+            defaultValue=None,
+            optional=True,
+        )
+        memory_param.setFlags(memory_param.flags() | QgsProcessingParameterDefinition.Flag.FlagAdvanced)
+        self.addParameter(memory_param)
+
+    def calcArguments(self, parameters, context):
+        """Returns the --threads & --memory_budget script arguments list, a single thread unless set: the dialog already
+        runs several of these algorithms at once"""
+        if self.THREADS not in parameters or parameters[self.THREADS] is None:
+            arguments = ["--threads 1"]
+        else:
+            arguments = [f"--threads {self.parameterAsInt(parameters, self.THREADS, context)}"]
+        memory_budget = self.parameterAsString(parameters, self.MEMORY_BUDGET, context).strip()
+        if memory_budget:
+            from gdal_calc import parse_memory
+
+            try:
+                arguments += [f"--memory_budget {parse_memory(memory_budget)}"]
+            except ValueError as e:
+                raise QgsProcessingException(self.tr(str(e))) from e
+        return arguments
+
+    def processAlgorithm(self, parameters, context, feedback):
+        if not self.parameterAsBoolean(parameters, self.IN_PROCESS, context):
+            return super().processAlgorithm(parameters, context, feedback)
+
+        commands = self.getConsoleCommands(parameters, context, feedback, executing=True)
+        # drop the python interpreter and script path, arguments are joined and quoted as for the shell
+        argv = shlex.split(" ".join(commands[2:]))
+        feedback.pushCommandInfo(f"{self.commandName()} (in process) {' '.join(commands[2:])}")
+
+        def progress(complete, message, data):
+            feedback.setProgress(100 * complete)
+            if message:
+                feedback.pushInfo(message)
+            return 0 if feedback.isCanceled() else 1
+
+        try:
+            dataset = self.scriptMain()(["--return_dataset"] + argv, callback=progress, quiet=True)
+        except SystemExit as e:
+            # argparse errors
+            raise QgsProcessingException(self.tr(f"Invalid arguments for {self.commandName()}: {argv}")) from e
+        except Exception as e:
+            if feedback.isCanceled():
+                feedback.reportError(self.tr("Canceled"))
+                return {}
+            raise QgsProcessingException(str(e)) from e
+        # closes the output
+        del dataset
+
+        # auto generate outputs, same as GdalAlgorithm
+        results = {}
+        for o in self.outputDefinitions():
+            if o.name() in parameters:
+                results[o.name()] = parameters[o.name()]
+        for k, v in self.output_values.items():
+            results[k] = v
+        return results
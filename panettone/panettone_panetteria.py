@@ -43,6 +43,7 @@ from qgis.core import QgsProcessingProvider
 from qgis.PyQt.QtGui import QIcon
 
 from .panettone_gdal_calc_norm import ProcessingGdalCalcNormAlgorithm
+from .panettone_gdal_calc_normsum import ProcessingGdalCalcNormSumAlgorithm
 from .panettone_gdal_calc_sum import ProcessingGdalCalcSumAlgorithm
 from .resources import *
 
@@ -68,6 +69,7 @@ class PanettonePanetteria(QgsProcessingProvider):
         """
         self.addAlgorithm(ProcessingGdalCalcNormAlgorithm())
         self.addAlgorithm(ProcessingGdalCalcSumAlgorithm())
+        self.addAlgorithm(ProcessingGdalCalcNormSumAlgorithm())
 
     def id(self):
         """
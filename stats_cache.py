@@ -0,0 +1,621 @@
+# python3
+"""
+Persistent raster statistics cache, shared by the pan_batido dialog and the panettone scripts
+
+Each raster band is scanned once per file change, the statistics are stored as json files keyed by the file path, size
+and modification time, in:
+    $PAN_EUROPEO_STATS_CACHE, else
+    $XDG_CACHE_HOME/pan-europeo/stats, else
+    ~/.cache/pan-europeo/stats
+
+Usage:
+    from stats_cache import get_raster_stats
+    stats = get_raster_stats("raster.tif")
+    stats["min"], stats["max"], stats["nodata_count"], stats["extent"], stats["geotransform"]
+
+Windows of several rasters (not cached, such as the dialog extent) are reduced together by compute_windows_minmax.
+With approximate=True the windows are read from the rasters overviews, built into a sidecar .ovr when missing.
+
+Window histograms, in bins fixed over the whole raster min & max, are streamed by compute_histogram.
+
+Polygons (such as the selected features) are reduced over several rasters by compute_zonal_minmax, rasterizing them
+once per grid.
+
+The full scan also stores a min/max pyramid of PYRAMID_TILE pixels tiles ({key}.minmax.npz), exact windows combine
+its fully covered tiles and only read the raw pixels of the ragged edges
+"""
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from hashlib import sha1
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+
+from numpy import (add, arange, count_nonzero, empty, fmax, fmin, full, histogram, iinfo, inf, int64, isnan, logical_not,
+                   nan, savez_compressed, where, zeros)
+from numpy import load as np_load
+from osgeo import ogr
+from osgeo.gdal import ApplyGeoTransform, GA_ReadOnly, GDT_Byte, GetDriverByName, InvGeoTransform, Open, RasterizeLayer
+
+# pixels read by a compute_windows_minmax job, whole block rows
+CHUNK_PIXELS = 2**22
+# most pixels read from an overview by an approximate window reduction
+APPROX_PIXELS = 2**18
+# overviews are built down to this many pixels wide or tall
+OVERVIEW_MIN_SIZE = 256
+# min/max pyramid base tiles side, in pixels
+PYRAMID_TILE = 256
+# reduce_rows tuples
+STATS_KEYS = ["count", "min", "max"]
+# compute_histogram bins
+HISTOGRAM_BINS = 64
+
+
+def cache_dir() -> Path:
+    if directory := os.environ.get("PAN_EUROPEO_STATS_CACHE"):
+        return Path(directory)
+    xdg = os.environ.get("XDG_CACHE_HOME")
+    return (Path(xdg) if xdg else Path.home() / ".cache") / "pan-europeo" / "stats"
+
+
+def cache_key(filename, band=1):
+    """path + size + mtime + band hash, None if the file can't be stat (not a local file)"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    path = str(Path(filename).resolve())
+    return sha1(f"{path}|{stat.st_size}|{stat.st_mtime_ns}|{band}".encode()).hexdigest()
+
+
+def load(key):
+    try:
+        with open(cache_dir() / f"{key}.json", "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save(key, stats):
+    """atomic write, several processes may be scanning the same raster"""
+    directory = cache_dir()
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile("w", dir=directory, suffix=".tmp", delete=False) as f:
+            json.dump(stats, f)
+        os.replace(f.name, directory / f"{key}.json")
+    except (OSError, TypeError, ValueError) as e:
+        print(f"stats_cache: couldn't write {key=}, {e}")
+        if "f" in locals():
+            Path(f.name).unlink(missing_ok=True)
+
+
+def valid_mask(data, nodata, out=None):
+    """True on the cells that are neither nodata nor nan, into the out buffer when its shape matches"""
+    if out is None or out.shape != data.shape:
+        out = empty(data.shape, dtype=bool)
+    if data.dtype.kind == "f":
+        isnan(data, out=out)
+        logical_not(out, out=out)
+    else:
+        out.fill(True)
+    if nodata is not None and not math.isnan(nodata):
+        out &= data != nodata
+    return out
+
+
+def block_minmax(data, mask):
+    """Valid cells count, min & max of the block without copying the valid cells; None min & max if there are none"""
+    count = int(count_nonzero(mask))
+    if count == 0:
+        return 0, None, None
+    if count == mask.size:
+        return count, data.min().item(), data.max().item()
+    if data.dtype.kind == "f":
+        highest, lowest = inf, -inf
+    else:
+        highest, lowest = iinfo(data.dtype).max, iinfo(data.dtype).min
+    return count, data.min(where=mask, initial=highest).item(), data.max(where=mask, initial=lowest).item()
+
+
+def empty_stats():
+    return 0, None, None
+
+
+def merge_stats(a, b):
+    """merges 2 (count, min, max) tuples"""
+    if a[0] == 0:
+        return b
+    if b[0] == 0:
+        return a
+    return a[0] + b[0], min(a[1], b[1]), max(a[2], b[2])
+
+
+def pixel_window(geotransform, size, bbox):
+    """(xoff, yoff, xsize, ysize) of the pixels touched by bbox [xmin, ymin, xmax, ymax], clipped to the raster size;
+    None if they don't intersect"""
+    inv_geotransform = InvGeoTransform(geotransform)
+    if not inv_geotransform:
+        raise RuntimeError("Failed to invert geotransform.")
+    corners = [ApplyGeoTransform(inv_geotransform, x, y) for x in bbox[0::2] for y in bbox[1::2]]
+    # tolerate floating point noise on the pixel edges
+    x_off = max(0, math.floor(min(col for col, _ in corners) + 1e-9))
+    y_off = max(0, math.floor(min(row for _, row in corners) + 1e-9))
+    x_end = min(size[0], math.ceil(max(col for col, _ in corners) - 1e-9))
+    y_end = min(size[1], math.ceil(max(row for _, row in corners) - 1e-9))
+    if x_end <= x_off or y_end <= y_off:
+        return None
+    return x_off, y_off, x_end - x_off, y_end - y_off
+
+
+def build_overviews(dataset):
+    """Nearest neighbour overviews (keeping actual cell values), halving down to OVERVIEW_MIN_SIZE; opened read only
+    gdal writes them into a sidecar .ovr"""
+    levels, factor = [], 2
+    while max(dataset.RasterXSize, dataset.RasterYSize) // factor >= OVERVIEW_MIN_SIZE:
+        levels += [factor]
+        factor *= 2
+    if not levels:
+        return
+    try:
+        dataset.BuildOverviews("NEAREST", levels)
+    except RuntimeError as e:
+        print(f"stats_cache: couldn't build {dataset.GetDescription()} overviews, {e}")
+
+
+def overview_window(dataset, band, window, max_pixels=APPROX_PIXELS, build=True):
+    """The finest overview of the band where the window has at most max_pixels (else the coarsest one), building them
+    if missing. Returns the overview index (None for the full resolution band) and the window scaled to it"""
+    x_off, y_off, x_size, y_size = window
+    if x_size * y_size <= max_pixels:
+        return None, window
+    raster_band = dataset.GetRasterBand(band)
+    if raster_band.GetOverviewCount() == 0 and build:
+        build_overviews(dataset)
+        raster_band = dataset.GetRasterBand(band)
+    best = None, window
+    for index in range(raster_band.GetOverviewCount()):
+        overview = raster_band.GetOverview(index)
+        x_factor = overview.XSize / dataset.RasterXSize
+        y_factor = overview.YSize / dataset.RasterYSize
+        x_start, y_start = math.floor(x_off * x_factor), math.floor(y_off * y_factor)
+        x_end = max(x_start + 1, min(overview.XSize, math.ceil((x_off + x_size) * x_factor)))
+        y_end = max(y_start + 1, min(overview.YSize, math.ceil((y_off + y_size) * y_factor)))
+        scaled = (x_start, y_start, x_end - x_start, y_end - y_start)
+        pixels, best_pixels = scaled[2] * scaled[3], best[1][2] * best[1][3]
+        # finer if it fits, coarser while nothing fits
+        if (pixels <= max_pixels and (best_pixels > max_pixels or pixels > best_pixels)) or (
+            best_pixels > max_pixels and pixels < best_pixels
+        ):
+            best = index, scaled
+    return best
+
+
+def reduce_rows(filename, band, x_off, y_off, x_size, y_size, overview=None):
+    """(count, min, max) of the window of the band (or its overview index), read block row by block row
+    into reused buffers"""
+    dataset = Open(str(filename), GA_ReadOnly)
+    if dataset is None:
+        raise FileNotFoundError(filename)
+    raster_band = dataset.GetRasterBand(band)
+    nodata = raster_band.GetNoDataValue()
+    if overview is not None:
+        raster_band = raster_band.GetOverview(overview)
+    _, block_y = raster_band.GetBlockSize()
+    result = empty_stats()
+    data, mask = None, None
+    for yoff in range(y_off, y_off + y_size, block_y):
+        rows = min(block_y, y_off + y_size - yoff)
+        if data is not None and data.shape[0] != rows:
+            data = None
+        data = raster_band.ReadAsArray(x_off, yoff, x_size, rows, buf_obj=data)
+        if data is None:
+            raise RuntimeError(f"Failed to read {filename} rows {yoff}:{yoff + rows}")
+        mask = valid_mask(data, nodata, out=mask)
+        result = merge_stats(result, block_minmax(data, mask))
+    return result
+
+
+def tile_minmax(data, mask, tile=PYRAMID_TILE):
+    """Per tile column count, min & max of block rows all inside the same tile row; nan min & max for empty tiles"""
+    starts = arange(0, data.shape[1], tile)
+    values = where(mask, data, nan)
+    return (
+        add.reduceat(mask, starts, axis=1, dtype=int64).sum(axis=0),
+        fmin.reduce(fmin.reduceat(values, starts, axis=1), axis=0),
+        fmax.reduce(fmax.reduceat(values, starts, axis=1), axis=0),
+    )
+
+
+def pyramid_levels(counts, mins, maxs):
+    """Halves the (counts, mins, maxs) tiles grids 2x2 until a single tile is left, level 0 being the given grids"""
+    levels = [(counts, mins, maxs)]
+    while max(counts.shape) > 1:
+        rows, cols = math.ceil(counts.shape[0] / 2), math.ceil(counts.shape[1] / 2)
+        level = []
+        for grid, reduce, identity in [(counts, add, 0), (mins, fmin, nan), (maxs, fmax, nan)]:
+            padded = full((rows * 2, cols * 2), identity, dtype=grid.dtype)
+            padded[: grid.shape[0], : grid.shape[1]] = grid
+            level += [
+                reduce(reduce(padded[0::2, 0::2], padded[0::2, 1::2]), reduce(padded[1::2, 0::2], padded[1::2, 1::2]))
+            ]
+        counts, mins, maxs = level
+        levels += [(counts, mins, maxs)]
+    return levels
+
+
+def query_pyramid(levels, y0, y1, x0, x1):
+    """(count, min, max) of the level 0 tiles [y0, y1) x [x0, x1): the coarsest tiles fully inside are taken whole and
+    the uncovered fringe recursed into finer levels, O(log n) tiles"""
+    if y1 <= y0 or x1 <= x0:
+        return 0, nan, nan
+    rows, cols = levels[0][0].shape
+    for level in range(len(levels) - 1, -1, -1):
+        factor = 2**level
+        # a coarse tile is inside when all its level 0 tiles are, the last one may be cut by the grid edge
+        cy0, cx0 = -(-y0 // factor), -(-x0 // factor)
+        cy1 = -(-y1 // factor) if y1 == rows else y1 // factor
+        cx1 = -(-x1 // factor) if x1 == cols else x1 // factor
+        if cy1 <= cy0 or cx1 <= cx0:
+            continue
+        counts, mins, maxs = levels[level]
+        result = (
+            int(counts[cy0:cy1, cx0:cx1].sum()),
+            float(fmin.reduce(mins[cy0:cy1, cx0:cx1], axis=None)),
+            float(fmax.reduce(maxs[cy0:cy1, cx0:cx1], axis=None)),
+        )
+        iy0, iy1 = cy0 * factor, min(cy1 * factor, rows)
+        ix0, ix1 = cx0 * factor, min(cx1 * factor, cols)
+        for fringe in [(y0, iy0, x0, x1), (iy1, y1, x0, x1), (iy0, iy1, x0, ix0), (iy0, iy1, ix1, x1)]:
+            count, low, high = query_pyramid(levels, *fringe)
+            result = result[0] + count, float(fmin(result[1], low)), float(fmax(result[2], high))
+        return result
+    return 0, nan, nan
+
+
+def pyramid_file(key) -> Path:
+    return cache_dir() / f"{key}.minmax.npz"
+
+
+def save_pyramid(key, counts, mins, maxs, integer):
+    """atomic write of the level 0 tiles, the coarser levels are rebuilt on load"""
+    directory = cache_dir()
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile("wb", dir=directory, suffix=".tmp", delete=False) as f:
+            savez_compressed(f, counts=counts, mins=mins, maxs=maxs, integer=integer, tile=PYRAMID_TILE)
+        os.replace(f.name, pyramid_file(key))
+    except OSError as e:
+        print(f"stats_cache: couldn't write {key=} pyramid, {e}")
+        if "f" in locals():
+            Path(f.name).unlink(missing_ok=True)
+
+
+def load_pyramid(filename, band=1):
+    """{"levels", "integer", "tile"} min/max pyramid of the band, None if it wasn't scanned (see get_raster_stats)"""
+    key = cache_key(filename, band)
+    if not key:
+        return None
+    try:
+        with np_load(pyramid_file(key)) as npz:
+            if int(npz["tile"]) != PYRAMID_TILE:
+                return None
+            return {
+                "levels": pyramid_levels(npz["counts"], npz["mins"], npz["maxs"]),
+                "integer": bool(npz["integer"]),
+                "tile": PYRAMID_TILE,
+            }
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def pyramid_window(pyramid, window, size):
+    """Splits the pixel window into the (count, min, max) of its fully covered tiles & the (x_off, y_off, x_size,
+    y_size) ragged edge strips still to be read"""
+    tile = pyramid["tile"]
+    x_off, y_off, x_size, y_size = window
+    x_end, y_end = x_off + x_size, y_off + y_size
+    # fully covered tiles, the last tile of a row or column may be cut by the raster edge
+    tx0, ty0 = -(-x_off // tile), -(-y_off // tile)
+    tx1 = -(-x_end // tile) if x_end == size[0] else x_end // tile
+    ty1 = -(-y_end // tile) if y_end == size[1] else y_end // tile
+    if tx1 <= tx0 or ty1 <= ty0:
+        return empty_stats(), [window]
+    count, low, high = query_pyramid(pyramid["levels"], ty0, ty1, tx0, tx1)
+    if count == 0:
+        covered = empty_stats()
+    elif pyramid["integer"]:
+        covered = count, int(low), int(high)
+    else:
+        covered = count, low, high
+    px0, px1 = tx0 * tile, min(tx1 * tile, size[0])
+    py0, py1 = ty0 * tile, min(ty1 * tile, size[1])
+    strips = [
+        (x_off, y_off, x_size, py0 - y_off),
+        (x_off, py1, x_size, y_end - py1),
+        (x_off, py0, px0 - x_off, py1 - py0),
+        (px1, py0, x_end - px1, py1 - py0),
+    ]
+    return covered, [strip for strip in strips if strip[2] > 0 and strip[3] > 0]
+
+
+def compute_histogram(filename, bbox=None, band=1, bins=HISTOGRAM_BINS) -> dict:
+    """Valid cells histogram of the bbox [xmin, ymin, xmax, ymax] window (None for the whole raster), streamed block row
+    by block row. The bins split the whole raster (cached) min & max, so every window of a raster shares them.
+
+    Returns {"counts", "min", "max"}, None if the window doesn't intersect the raster"""
+    stats = get_raster_stats(filename, band)
+    dataset = Open(str(filename), GA_ReadOnly)
+    if dataset is None:
+        raise FileNotFoundError(filename)
+    size = (dataset.RasterXSize, dataset.RasterYSize)
+    window = (0, 0, *size) if bbox is None else pixel_window(dataset.GetGeoTransform(), size, bbox)
+    if window is None:
+        return None
+    counts = zeros(bins, dtype=int64)
+    if stats["min"] is None:
+        # all nodata
+        return {"counts": counts, "min": None, "max": None}
+    raster_band = dataset.GetRasterBand(band)
+    nodata = raster_band.GetNoDataValue()
+    _, block_y = raster_band.GetBlockSize()
+    x_off, y_off, x_size, y_size = window
+    data, mask = None, None
+    for yoff in range(y_off, y_off + y_size, block_y):
+        rows = min(block_y, y_off + y_size - yoff)
+        if data is not None and data.shape[0] != rows:
+            data = None
+        data = raster_band.ReadAsArray(x_off, yoff, x_size, rows, buf_obj=data)
+        if data is None:
+            raise RuntimeError(f"Failed to read {filename} rows {yoff}:{yoff + rows}")
+        mask = valid_mask(data, nodata, out=mask)
+        counts += histogram(data[mask], bins=bins, range=(stats["min"], stats["max"]))[0]
+    return {"counts": counts, "min": stats["min"], "max": stats["max"]}
+
+
+def compute_windows_minmax(windows, band=1, threads=None, progress=None, approximate=False) -> list:
+    """Exact min, max & valid cells count of several raster windows in one go. windows is a list of (filename, bbox),
+    bbox [xmin, ymin, xmax, ymax] in the raster crs. approximate reads each window from the finest overview holding it
+    in APPROX_PIXELS (see overview_window), the min & max are then within the exact ones. Exact windows of rasters with
+    a min/max pyramid (see get_raster_stats) only read the ragged edges around its fully covered tiles.
+
+    Every window is split in chunks of whole block rows, reduced block by block (no full window array) in a thread
+    pool shared by all the windows; progress(index, window_fraction, total_fraction) is called as chunks finish,
+    returning False cancels.
+
+    Returns a {"min", "max", "count"} dict per window (None min & max if all cells are nodata), None when the window
+    doesn't intersect its raster; or None if canceled"""
+    jobs = []
+    results = [None] * len(windows)
+    for index, (filename, bbox) in enumerate(windows):
+        dataset = Open(str(filename), GA_ReadOnly)
+        if dataset is None:
+            raise FileNotFoundError(filename)
+        size = (dataset.RasterXSize, dataset.RasterYSize)
+        window = pixel_window(dataset.GetGeoTransform(), size, bbox)
+        if window is None:
+            continue
+        overview, pieces = None, [window]
+        results[index] = empty_stats()
+        if approximate:
+            overview, window = overview_window(dataset, band, window)
+            pieces = [window]
+        elif pyramid := load_pyramid(filename, band):
+            results[index], pieces = pyramid_window(pyramid, window, size)
+        raster_band = dataset.GetRasterBand(band)
+        if overview is not None:
+            raster_band = raster_band.GetOverview(overview)
+        _, block_y = raster_band.GetBlockSize()
+        for x_off, y_off, x_size, y_size in pieces:
+            chunk_rows = max(block_y, CHUNK_PIXELS // x_size // block_y * block_y)
+            for yoff in range(y_off, y_off + y_size, chunk_rows):
+                rows = min(chunk_rows, y_off + y_size - yoff)
+                jobs += [(index, (filename, band, x_off, yoff, x_size, rows), overview)]
+        raster_band, dataset = None, None
+
+    window_pixels = [0] * len(windows)
+    for index, (*_, x_size, rows), _ in jobs:
+        window_pixels[index] += x_size * rows
+    total_pixels = sum(window_pixels) or 1
+    window_done = [0] * len(windows)
+    total_done = 0
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as executor:
+        futures = {
+            executor.submit(reduce_rows, *args, overview=overview): (index, args) for index, args, overview in jobs
+        }
+        try:
+            for future in as_completed(futures):
+                index, (*_, x_size, rows) = futures[future]
+                results[index] = merge_stats(results[index], future.result())
+                window_done[index] += x_size * rows
+                total_done += x_size * rows
+                window_fraction = window_done[index] / window_pixels[index]
+                if progress and progress(index, window_fraction, total_done / total_pixels) is False:
+                    return None
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return [None if result is None else dict(zip(STATS_KEYS, result)) for result in results]
+
+
+def rasterize_mask(geotransform, window, geometries):
+    """Boolean mask of the window cells whose center is inside any of the geometries (wkb, in the raster crs)"""
+    x_off, y_off, x_size, y_size = window
+    x_origin, y_origin = ApplyGeoTransform(geotransform, x_off, y_off)
+    target = GetDriverByName("MEM").Create("", x_size, y_size, 1, GDT_Byte)
+    target.SetGeoTransform([x_origin, geotransform[1], geotransform[2], y_origin, geotransform[4], geotransform[5]])
+    source = ogr.GetDriverByName("Memory").CreateDataSource("")
+    layer = source.CreateLayer("selection", geom_type=ogr.wkbUnknown)
+    for wkb in geometries:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+        layer.CreateFeature(feature)
+    RasterizeLayer(target, [1], layer, burn_values=[1])
+    return target.GetRasterBand(1).ReadAsArray().astype(bool)
+
+
+def zonal_rows(geotransform, window, rasters, geometries, envelopes, band=1):
+    """Rasterizes the geometries touching the window once, then reduces every (index, filename) raster of the grid
+    inside the mask, reading only the rows & columns the mask spans. Returns [(index, (count, min, max))]"""
+    x_off, y_off, x_size, y_size = window
+    x_min, y_max = ApplyGeoTransform(geotransform, x_off, y_off)
+    x_max, y_min = ApplyGeoTransform(geotransform, x_off + x_size, y_off + y_size)
+    x_min, x_max, y_min, y_max = min(x_min, x_max), max(x_min, x_max), min(y_min, y_max), max(y_min, y_max)
+    touching = [
+        wkb
+        for wkb, (e_x_min, e_x_max, e_y_min, e_y_max) in zip(geometries, envelopes)
+        if e_x_min <= x_max and e_x_max >= x_min and e_y_min <= y_max and e_y_max >= y_min
+    ]
+    if not touching:
+        return []
+    zone = rasterize_mask(geotransform, window, touching)
+    rows, cols = zone.any(axis=1).nonzero()[0], zone.any(axis=0).nonzero()[0]
+    if rows.size == 0:
+        return []
+    r0, r1, c0, c1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+    zone = zone[r0:r1, c0:c1]
+    results, mask = [], None
+    for index, filename in rasters:
+        dataset = Open(str(filename), GA_ReadOnly)
+        if dataset is None:
+            raise FileNotFoundError(filename)
+        raster_band = dataset.GetRasterBand(band)
+        data = raster_band.ReadAsArray(x_off + c0, y_off + r0, c1 - c0, r1 - r0)
+        if data is None:
+            raise RuntimeError(f"Failed to read {filename} rows {y_off + r0}:{y_off + r1}")
+        mask = valid_mask(data, raster_band.GetNoDataValue(), out=mask)
+        mask &= zone
+        results += [(index, block_minmax(data, mask))]
+    return results
+
+
+def compute_zonal_minmax(filenames, geometries, band=1, threads=None, progress=None) -> list:
+    """Exact min, max & valid cells count of several rasters inside polygons, geometries being their wkb in the
+    rasters crs, cells inside are the ones whose center is.
+
+    The rasters sharing a grid (geotransform & size) share the polygons mask: the polygons bounding box window is split
+    in chunks of whole block rows, each rasterized once for all the rasters of the grid (see zonal_rows) in a shared
+    thread pool; chunks without polygons aren't read. progress(total_fraction) is called as chunks finish, returning
+    False cancels.
+
+    Returns a {"min", "max", "count"} dict per raster (None min & max if no valid cell is inside), None when the
+    polygons don't intersect it; or None if canceled"""
+    envelopes = [ogr.CreateGeometryFromWkb(wkb).GetEnvelope() for wkb in geometries]
+    if not envelopes:
+        return [None] * len(filenames)
+    bbox = [
+        min(e[0] for e in envelopes),
+        min(e[2] for e in envelopes),
+        max(e[1] for e in envelopes),
+        max(e[3] for e in envelopes),
+    ]
+    grids = {}
+    for index, filename in enumerate(filenames):
+        dataset = Open(str(filename), GA_ReadOnly)
+        if dataset is None:
+            raise FileNotFoundError(filename)
+        grid = (tuple(dataset.GetGeoTransform()), (dataset.RasterXSize, dataset.RasterYSize))
+        block_y = dataset.GetRasterBand(band).GetBlockSize()[1]
+        grids.setdefault(grid, ([], block_y))[0].append((index, filename))
+        dataset = None
+
+    results = [None] * len(filenames)
+    jobs = []
+    for (geotransform, size), (rasters, block_y) in grids.items():
+        window = pixel_window(geotransform, size, bbox)
+        if window is None:
+            continue
+        for index, _ in rasters:
+            results[index] = empty_stats()
+        x_off, y_off, x_size, y_size = window
+        chunk_rows = max(block_y, CHUNK_PIXELS // x_size // block_y * block_y)
+        for yoff in range(y_off, y_off + y_size, chunk_rows):
+            jobs += [(geotransform, (x_off, yoff, x_size, min(chunk_rows, y_off + y_size - yoff)), rasters)]
+
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(zonal_rows, geotransform, window, rasters, geometries, envelopes, band)
+            for geotransform, window, rasters in jobs
+        ]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                for index, stats in future.result():
+                    results[index] = merge_stats(results[index], stats)
+                if progress and progress(done / len(futures)) is False:
+                    return None
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return [None if result is None else dict(zip(STATS_KEYS, result)) for result in results]
+
+
+def compute_raster_stats(filename, band=1) -> dict:
+    """Exact min, max and nodata count scanning the band block by block; plus nodata value, extent (xmin, ymin, xmax,
+    ymax), geotransform and size"""
+    return scan_raster(filename, band)[0]
+
+
+def scan_raster(filename, band=1):
+    """compute_raster_stats & the (counts, mins, maxs, integer) PYRAMID_TILE tiles of the min/max pyramid"""
+    dataset = Open(str(filename), GA_ReadOnly)
+    if dataset is None:
+        raise FileNotFoundError(filename)
+    geotransform = dataset.GetGeoTransform()
+    x_size = dataset.RasterXSize
+    y_size = dataset.RasterYSize
+    raster_band = dataset.GetRasterBand(band)
+    nodata = raster_band.GetNoDataValue()
+
+    tiles_shape = math.ceil(y_size / PYRAMID_TILE), math.ceil(x_size / PYRAMID_TILE)
+    counts, mins, maxs = zeros(tiles_shape, dtype=int64), full(tiles_shape, nan), full(tiles_shape, nan)
+
+    # whole rows of blocks
+    _, block_y = raster_band.GetBlockSize()
+    result, nodata_count, mask = empty_stats(), 0, None
+    for yoff in range(0, y_size, block_y):
+        data = raster_band.ReadAsArray(0, yoff, x_size, min(block_y, y_size - yoff))
+        mask = valid_mask(data, nodata, out=mask)
+        block = block_minmax(data, mask)
+        if nodata is not None:
+            # nan cells of a raster without nodata aren't nodata
+            nodata_count += data.size - block[0]
+        result = merge_stats(result, block)
+        # the block rows of each tile row
+        for start in range(yoff - yoff % PYRAMID_TILE, yoff + data.shape[0], PYRAMID_TILE):
+            rows = slice(max(start, yoff) - yoff, min(start + PYRAMID_TILE, yoff + data.shape[0]) - yoff)
+            tile_row = start // PYRAMID_TILE
+            tile_counts, tile_mins, tile_maxs = tile_minmax(data[rows], mask[rows])
+            counts[tile_row] += tile_counts
+            fmin(mins[tile_row], tile_mins, out=mins[tile_row])
+            fmax(maxs[tile_row], tile_maxs, out=maxs[tile_row])
+    _, rmin, rmax = result
+
+    x_min, y_max = ApplyGeoTransform(geotransform, 0, 0)
+    x_max, y_min = ApplyGeoTransform(geotransform, x_size, y_size)
+    stats = {
+        "min": rmin,
+        "max": rmax,
+        "nodata": nodata,
+        "nodata_count": nodata_count,
+        "extent": [x_min, y_min, x_max, y_max],
+        "geotransform": list(geotransform),
+        "size": [x_size, y_size],
+    }
+    return stats, (counts, mins, maxs, data.dtype.kind in "iu")
+
+
+def get_raster_stats(filename, band=1, force=False) -> dict:
+    """Cached compute_raster_stats, force rescans the raster and refreshes the cache; the same scan stores the min/max
+    pyramid (rescanning rasters cached before it existed)"""
+    key = cache_key(filename, band)
+    if key and not force and (stats := load(key)) and pyramid_file(key).is_file():
+        return stats
+    stats, tiles = scan_raster(filename, band)
+    if key:
+        save(key, stats)
+        save_pyramid(key, *tiles)
+    return stats